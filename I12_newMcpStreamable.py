@@ -1,49 +1,2214 @@
 """Enhanced MCP server with weather and forecast functionality."""
 
 import argparse
+import asyncio
+import bisect
+import collections
+import contextlib
+import contextvars
+import dis
+import email.utils
+import functools
+import gc
+import hashlib
+import heapq
+import itertools
 import json
+import logging
+import logging.handlers
+import math
+import mmap
+import queue
+import random
+import re
+import sqlite3
+import struct
+import sys
+import threading
 import time
 import os
+import zlib
+from array import array
+from collections import OrderedDict, deque
 from typing import Any, Dict, Optional
 import uvicorn
 import httpx
+import numpy as np
 from mcp.server.fastmcp import FastMCP
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 from starlette.requests import Request
 
-mcp = FastMCP(name="weather-test-server", json_response=False, stateless_http=False)
+# Multi-worker mode (--workers N) runs stateless so any worker can serve any request
+MCP_WORKERS = max(int(os.getenv("MCP_WORKERS", 1)), 1)
+MCP_STATELESS_HTTP = os.getenv("MCP_STATELESS_HTTP", "false").lower() == "true"
+
+mcp = FastMCP(name="weather-test-server", json_response=False, stateless_http=MCP_STATELESS_HTTP)
 
 # Weather API configuration
-OPENWEATHER_API_BASE = "https://api.openweathermap.org/data/2.5"
-GEO_API_BASE = "https://api.openweathermap.org/geo/1.0"
+OPENWEATHER_API_BASE = os.getenv("OPENWEATHER_API_BASE", "https://api.openweathermap.org/data/2.5")
+GEO_API_BASE = os.getenv("GEO_API_BASE", "https://api.openweathermap.org/geo/1.0")
 API_KEY = os.getenv("OPENWEATHER_API_KEY", "demo")  # Get from environment variable
 
-async def make_weather_request(url: str) -> Dict[str, Any] | None:
-    """Make a request to OpenWeatherMap API with error handling."""
-    async with httpx.AsyncClient() as client:
+# Fast JSON encoding: orjson when installed, stdlib json otherwise
+try:
+    import orjson
+
+    def json_dumps(value: Any, indent: bool = False) -> bytes:
+        """Serialize a value to JSON bytes."""
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(value, option=option)
+
+    json_loads = orjson.loads
+except ImportError:
+    print("Warning: orjson not installed, using stdlib json. Install with: pip install orjson")
+
+    def json_dumps(value: Any, indent: bool = False) -> bytes:
+        """Serialize a value to JSON bytes."""
+        if indent:
+            return json.dumps(value, ensure_ascii=False, indent=2).encode()
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+    json_loads = json.loads
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the fast JSON encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+# Structured logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")  # e.g. "/mcp=0.1,/health=0"
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", 512))
+
+class StructuredLogger:
+    """JSON-lines logger whose output is written by a background thread.
+
+    Records are put on a queue and a QueueListener thread does the actual
+    stdout writes, so logging never blocks the event loop. Records can be
+    sampled per route, and payload fields are truncated to max_payload bytes.
+    Disabled levels return before any formatting, and callers building
+    expensive fields can check debug_enabled first.
+    """
+
+    def __init__(self, name: str, level: str, sample_rates: str, max_payload: int):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(getattr(logging, level, logging.INFO))
+        self.logger.propagate = False
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.logger.handlers = [logging.handlers.QueueHandler(self.queue)]
+        self.listener = logging.handlers.QueueListener(self.queue, logging.StreamHandler(sys.stdout))
+        self.sample_rates = self.parse_sample_rates(sample_rates)
+        self.max_payload = max_payload
+        self.debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        self.started = False
+
+    @staticmethod
+    def parse_sample_rates(spec: str) -> Dict[str, float]:
+        """Parse "route=rate,route=rate" into a dict."""
+        rates = {}
+        for item in spec.split(","):
+            route, sep, rate = item.partition("=")
+            if sep and route.strip():
+                rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+        return rates
+
+    def start(self) -> None:
+        """Start the background writer thread."""
+        if not self.started:
+            self.listener.start()
+            self.started = True
+
+    def stop(self) -> None:
+        """Flush queued records and stop the writer thread."""
+        if self.started:
+            self.listener.stop()
+            self.started = False
+
+    def truncate(self, value: Any) -> str:
+        """Serialize a payload and cut it to max_payload bytes."""
         try:
-            response = await client.get(url, timeout=10.0)
-            if response.status_code == 401:
-                return {"error": "Invalid API key. Please set a valid OpenWeatherMap API key."}
-            response.raise_for_status()
-            return response.json()
-        except httpx.TimeoutException:
-            return {"error": "Request timeout"}
-        except Exception as e:
-            return {"error": f"Request failed: {str(e)}"}
+            text = json_dumps(value).decode()
+        except TypeError:
+            text = repr(value)
+        if len(text) > self.max_payload:
+            return f"{text[:self.max_payload]}...(+{len(text) - self.max_payload} bytes)"
+        return text
 
-async def get_coordinates(city: str) -> Optional[tuple]:
-    """Get latitude and longitude for a city."""
-    url = f"{GEO_API_BASE}/direct?q={city}&limit=1&appid={API_KEY}"
-    data = await make_weather_request(url)
+    def log(self, level: int, event: str, route: Optional[str] = None, payload: Any = None, **fields) -> None:
+        """Queue one structured record if the level is enabled and the route is sampled."""
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = self.sample_rates.get(route, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        record = {"ts": round(time.time(), 3), "level": logging.getLevelName(level), "event": event}
+        if route is not None:
+            record["route"] = route
+        record.update(fields)
+        if payload is not None:
+            record["payload"] = self.truncate(payload)
+        self.logger.log(level, json_dumps(record).decode())
+
+    def debug(self, event: str, **fields) -> None:
+        """Log a debug record; free when debug logging is off."""
+        if self.debug_enabled:
+            self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields) -> None:
+        """Log an info record."""
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields) -> None:
+        """Log a warning record."""
+        self.log(logging.WARNING, event, **fields)
+
+log = StructuredLogger("weather-mcp", LOG_LEVEL, LOG_SAMPLE_RATES, LOG_MAX_PAYLOAD)
+
+# Prometheus-style metrics, rendered in text exposition format at /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", 0.5))
+
+def format_labels(names: tuple, values: tuple) -> str:
+    """Format label names and values as {name="value",...}."""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Counter:
+    """Monotonic counter, optionally labelled."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0) -> None:
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render(self) -> list:
+        return [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in self.values.items()]
+
+class Gauge(Counter):
+    """Value that can go up and down, optionally labelled."""
+
+    kind = "gauge"
+
+    def set(self, value: float, *label_values) -> None:
+        self.values[label_values] = value
+
+    def dec(self, *label_values, amount: float = 1.0) -> None:
+        self.values[label_values] = self.values.get(label_values, 0.0) - amount
+
+class Histogram:
+    """Bucketed distribution of observed values, optionally labelled."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values: Dict[tuple, list] = {}  # key -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value: float, *label_values) -> None:
+        data = self.values.get(label_values)
+        if data is None:
+            data = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def render(self) -> list:
+        lines = []
+        for key, data in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {data[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Holds metrics and collectors and renders them for Prometheus.
+
+    Recording is a dict update (plus a bisect for histograms), so metrics
+    stay on in production. Collectors read existing stats at scrape time.
+    """
+
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Register func() -> [(name, kind, help, [(labels, value), ...]), ...]."""
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, kind, help_text, samples in collect():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+tool_calls = metrics.register(Counter("mcp_tool_calls_total", "Tool calls received on /mcp", ("tool",)))
+tool_errors = metrics.register(Counter("mcp_tool_errors_total", "Tool calls that returned a JSON-RPC error", ("tool",)))
+tool_latency = metrics.register(Histogram("mcp_tool_duration_seconds", "Tool call latency", ("tool",)))
+mcp_in_flight = metrics.register(Gauge("mcp_requests_in_flight", "POST /mcp requests being handled"))
+deadline_exceeded = metrics.register(Counter("mcp_deadline_exceeded_total", "Tool calls cancelled at their request deadline", ("tool",)))
+client_disconnects = metrics.register(Counter("mcp_client_disconnects_total", "POST /mcp requests abandoned because the client disconnected"))
+upstream_latency = metrics.register(Histogram("upstream_request_duration_seconds", "OpenWeatherMap request latency", ("endpoint",)))
+upstream_responses = metrics.register(Counter("upstream_requests_total", "OpenWeatherMap requests by outcome", ("endpoint", "status")))
+upstream_in_flight = metrics.register(Gauge("upstream_requests_in_flight", "OpenWeatherMap requests in flight"))
+upstream_retries = metrics.register(Counter("upstream_retries_total", "OpenWeatherMap requests retried after a 429 or transient failure", ("endpoint",)))
+event_loop_lag = metrics.register(Gauge("event_loop_lag_seconds", "Most recent event loop scheduling delay"))
+event_loop_lag_histogram = metrics.register(Histogram(
+    "event_loop_lag_distribution_seconds", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+))
+
+def upstream_endpoint(url: str) -> str:
+    """Short endpoint label for an upstream URL, e.g. "weather" or "direct"."""
+    return url.split("?", 1)[0].rsplit("/", 1)[-1]
+
+async def monitor_event_loop_lag(interval: float) -> None:
+    """Measure how late the event loop wakes up from a sleep."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        event_loop_lag.set(lag)
+        event_loop_lag_histogram.observe(lag)
+
+# Upstream HTTP connection pool configuration
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30.0))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 10.0))  # Per upstream call, cut to the request's remaining time
+
+# Per-request deadlines. A tool call gets REQUEST_TIMEOUT seconds unless the
+# client sends its own (X-Request-Timeout header or _meta.timeout param),
+# capped at REQUEST_TIMEOUT_MAX. The deadline travels with the call's
+# context; upstream calls are shared between callers, so they run
+# detached from it, and each caller stops waiting at its own deadline.
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 15.0))
+REQUEST_TIMEOUT_MAX = float(os.getenv("REQUEST_TIMEOUT_MAX", 60.0))
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+def parse_timeout(value: Any) -> Optional[float]:
+    """A client-supplied timeout in seconds, capped at REQUEST_TIMEOUT_MAX, or None if missing or invalid."""
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    return min(timeout, REQUEST_TIMEOUT_MAX) if timeout > 0 else None
+
+def detached_context() -> contextvars.Context:
+    """A copy of the current context without a request deadline, for work that outlives the request."""
+    context = contextvars.copy_context()
+    context.run(request_deadline.set, None)
+    return context
+
+# Shared upstream client, created on startup and closed on shutdown
+http_client: Optional[httpx.AsyncClient] = None
+http2_active = False
+pool_waits = 0
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled HTTP client used for all upstream calls."""
+    global http2_active
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("Warning: h2 not installed, using HTTP/1.1. Install with: pip install 'httpx[http2]'")
+            http2 = False
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    http2_active = http2
+    return httpx.AsyncClient(limits=limits, http2=http2, timeout=UPSTREAM_TIMEOUT)
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it if startup has not run yet."""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+    return http_client
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client and release pooled connections."""
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+def get_connection_pool():
+    """Return the httpcore connection pool behind the shared client, if any."""
+    return getattr(getattr(http_client, "_transport", None), "_pool", None)
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Get connection pool statistics for monitoring."""
+    pool = get_connection_pool()
+    connections = list(pool.connections) if pool is not None else []
+    requests = list(getattr(pool, "_requests", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "in_use": len(connections) - idle,
+        "idle": idle,
+        "queued_requests": sum(1 for request in requests if request.is_queued()),
+        "waits": pool_waits,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        "http2": http2_active,
+    }
+
+# Geocoding cache configuration
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", 10000))
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600))  # 30 days
+GEOCODE_CACHE_DB = os.getenv("GEOCODE_CACHE_DB", "geocode_cache.db")
+GEOCODE_MISS_TTL = float(os.getenv("GEOCODE_MISS_TTL", 3600))  # Names the geocoder didn't find, 0 disables
+
+def open_shared_db(path: str) -> sqlite3.Connection:
+    """Open a SQLite file in WAL mode so several worker processes can share it."""
+    db = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+    db.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+def normalize_city(city: str) -> str:
+    """Normalize a city name for use as a cache key."""
+    return " ".join(city.split()).casefold()
+
+class GeocodeCache:
+    """LRU and TTL bounded cache of city coordinates, persisted to SQLite.
+
+    Lookups are served from memory first. Writes go to the SQLite file in a
+    worker thread, and unexpired rows are loaded back into memory on startup.
+    On a memory miss, load() reads the file, which also picks up entries
+    written by other worker processes.
+    """
+
+    def __init__(self, path: str, maxsize: int, ttl: float, miss_ttl: float = 0):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.entries: OrderedDict[str, tuple] = OrderedDict()  # key -> (lat, lon, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        self.accesses: Dict[str, int] = {}  # key -> lookups not yet added to the file
+        self.unknown: OrderedDict[str, float] = OrderedDict()  # key -> when the geocoder's miss expires
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+
+    def open(self) -> None:
+        """Open the SQLite file and load unexpired entries into memory."""
+        if not self.path or self.db is not None:
+            return
+        self.db = open_shared_db(self.path)
+        with self.db_lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "city TEXT PRIMARY KEY, lat REAL, lon REAL, expires_at REAL)"
+            )
+            self.db.execute("CREATE TABLE IF NOT EXISTS city_access (city TEXT PRIMARY KEY, hits INTEGER)")
+            self.db.execute("DELETE FROM geocode WHERE expires_at <= ?", (time.time(),))
+            self.db.commit()
+            rows = self.db.execute(
+                "SELECT city, lat, lon, expires_at FROM geocode ORDER BY expires_at DESC LIMIT ?",
+                (self.maxsize,),
+            ).fetchall()
+        for city, lat, lon, expires_at in reversed(rows):
+            self.entries[city] = (lat, lon, expires_at)
+
+    def close(self) -> None:
+        """Close the SQLite file."""
+        if self.db is not None:
+            with self.db_lock:
+                self.db.close()
+            self.db = None
+
+    def get(self, city: str) -> Optional[tuple]:
+        """Return cached (lat, lon) for a city, or None on a miss."""
+        key = normalize_city(city)
+        entry = self.entries.get(key)
+        if entry is None or entry[2] <= time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    async def load(self, city: str) -> Optional[tuple]:
+        """Look a city up in the SQLite file after a memory miss."""
+        if self.db is None:
+            return None
+        key = normalize_city(city)
+        row = await asyncio.to_thread(self.read, key)
+        if row is None:
+            return None
+        self.db_hits += 1
+        self.remember(key, *row)
+        return row[0], row[1]
+
+    def read(self, key: str) -> Optional[tuple]:
+        """Read one unexpired entry from the SQLite file."""
+        with self.db_lock:
+            if self.db is None:
+                return None
+            return self.db.execute(
+                "SELECT lat, lon, expires_at FROM geocode WHERE city = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+
+    def remember(self, key: str, lat: float, lon: float, expires_at: float) -> None:
+        """Put an entry in memory, evicting the least recently used."""
+        self.entries[key] = (lat, lon, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def is_unknown(self, city: str) -> bool:
+        """Whether the geocoder recently found nothing for a city."""
+        key = normalize_city(city)
+        expires_at = self.unknown.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            del self.unknown[key]
+            return False
+        return True
+
+    def remember_unknown(self, city: str) -> None:
+        """Remember a city the geocoder found nothing for, in memory only, for miss_ttl seconds."""
+        if self.miss_ttl <= 0:
+            return
+        key = normalize_city(city)
+        self.unknown[key] = time.time() + self.miss_ttl
+        self.unknown.move_to_end(key)
+        while len(self.unknown) > self.maxsize:
+            self.unknown.popitem(last=False)
+
+    async def set(self, city: str, coords: tuple) -> None:
+        """Cache coordinates for a city and persist them."""
+        key = normalize_city(city)
+        lat, lon = coords
+        expires_at = time.time() + self.ttl
+        self.remember(key, lat, lon, expires_at)
+        if self.db is not None:
+            await asyncio.to_thread(self.persist, key, lat, lon, expires_at)
+
+    def persist(self, key: str, lat: float, lon: float, expires_at: float) -> None:
+        """Write one entry to the SQLite file."""
+        with self.db_lock:
+            if self.db is None:
+                return
+            self.db.execute(
+                "INSERT OR REPLACE INTO geocode (city, lat, lon, expires_at) VALUES (?, ?, ?, ?)",
+                (key, lat, lon, expires_at),
+            )
+            self.db.commit()
+
+    def import_entries(self, rows: list) -> int:
+        """Load unexpired [key, [lat, lon, expires_at]] snapshot rows that are not already cached."""
+        now = time.time()
+        restored = 0
+        for key, (lat, lon, expires_at) in rows:
+            if expires_at > now and key not in self.entries:
+                self.remember(key, lat, lon, expires_at)
+                restored += 1
+        return restored
+
+    def record_access(self, city: str) -> None:
+        """Count a lookup of a city towards its popularity."""
+        key = normalize_city(city)
+        self.accesses[key] = self.accesses.get(key, 0) + 1
+
+    async def flush_accesses(self) -> None:
+        """Add the lookups counted since the last flush to the SQLite file."""
+        if self.db is None or not self.accesses:
+            return
+        accesses, self.accesses = self.accesses, {}
+        await asyncio.to_thread(self.persist_accesses, accesses)
+
+    def persist_accesses(self, accesses: Dict[str, int]) -> None:
+        """Write lookup counts to the SQLite file."""
+        with self.db_lock:
+            if self.db is None:
+                return
+            self.db.executemany(
+                "INSERT INTO city_access (city, hits) VALUES (?, ?) "
+                "ON CONFLICT(city) DO UPDATE SET hits = hits + excluded.hits",
+                list(accesses.items()),
+            )
+            self.db.commit()
+
+    def top_cities(self, n: int) -> list:
+        """The n most looked-up cities, counting both the file and unflushed lookups."""
+        counts = dict(self.accesses)
+        with self.db_lock:
+            if self.db is not None and n > 0:
+                rows = self.db.execute(
+                    "SELECT city, hits FROM city_access ORDER BY hits DESC LIMIT ?", (n,)
+                ).fetchall()
+                for city, hits in rows:
+                    counts[city] = counts.get(city, 0) + hits
+        return sorted(counts, key=counts.get, reverse=True)[:n]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics for monitoring."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "db_hits": self.db_hits,
+            "unknown": len(self.unknown),
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+geocode_cache = GeocodeCache(GEOCODE_CACHE_DB, GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL, GEOCODE_MISS_TTL)
+
+# Offline geocoding from a city gazetteer built by I18_buildGazetteer.py
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "gazetteer.idx")
+GAZETTEER_MAX_MB = float(os.getenv("GAZETTEER_MAX_MB", 64))  # Larger files are not mapped
+GAZETTEER_MAGIC = b"GZT1"
+GAZETTEER_HEADER = struct.Struct("<4sII")  # magic, record count, record size
+GAZETTEER_RECORD = struct.Struct("<48s2sffI")  # normalized name, country code, lat, lon, population
+GAZETTEER_NAME_SIZE = 48
+
+class Gazetteer:
+    """City coordinates from a sorted index file, memory-mapped read-only.
+
+    Records are fixed-width and sorted by normalized name, then by
+    descending population, so a lookup is a binary search that returns the
+    most populous city with that name ("Paris,FR" restricts the country).
+    Opening only maps the file. Pages are read in as lookups touch them, so
+    memory use is bounded by the file size, which is capped at max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.data: Optional[mmap.mmap] = None
+        self.count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def open(self) -> None:
+        """Map the index file if there is a valid one."""
+        if not self.path or self.data is not None or not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size > self.max_bytes:
+            log.warning("gazetteer.too_large", path=self.path, bytes=size, max_bytes=int(self.max_bytes))
+            return
+        with open(self.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, record_size = GAZETTEER_HEADER.unpack_from(data, 0)
+        if (magic != GAZETTEER_MAGIC or record_size != GAZETTEER_RECORD.size
+                or GAZETTEER_HEADER.size + count * record_size > size):
+            log.warning("gazetteer.invalid", path=self.path)
+            data.close()
+            return
+        self.data = data
+        self.count = count
+
+    def close(self) -> None:
+        """Unmap the index file."""
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+            self.count = 0
+
+    def name_at(self, index: int) -> bytes:
+        """Padded name of the record at index."""
+        offset = GAZETTEER_HEADER.size + index * GAZETTEER_RECORD.size
+        return self.data[offset:offset + GAZETTEER_NAME_SIZE]
+
+    def names(self):
+        """Yield (record index, name) for every record, in sorted order."""
+        for index in range(self.count):
+            yield index, self.name_at(index).rstrip(b"\0").decode("utf-8")
+
+    def entry(self, index: int) -> tuple:
+        """(country, lat, lon, population) of the record at index."""
+        offset = GAZETTEER_HEADER.size + index * GAZETTEER_RECORD.size
+        _, country, lat, lon, population = GAZETTEER_RECORD.unpack_from(self.data, offset)
+        return country.decode("ascii"), round(lat, 4), round(lon, 4), population
+
+    def lookup(self, city: str) -> Optional[tuple]:
+        """Return (lat, lon) for a city name, optionally suffixed with ",CC", or None."""
+        if self.data is None:
+            return None
+        name, _, country = city.partition(",")
+        key = normalize_city(name).encode("utf-8")
+        country = country.strip().upper().encode("ascii", "replace")
+        if not key or len(key) > GAZETTEER_NAME_SIZE or len(country) not in (0, 2):
+            self.misses += 1
+            return None
+        index = self.find(key, country)
+        if index is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        _, lat, lon, _ = self.entry(index)
+        return lat, lon
+
+    def find(self, key: bytes, country: bytes = b"") -> Optional[int]:
+        """Index of the most populous record named key (normalized, UTF-8), in country if given, or None."""
+        key = key.ljust(GAZETTEER_NAME_SIZE, b"\0")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.name_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        while low < self.count and self.name_at(low) == key:
+            offset = GAZETTEER_HEADER.size + low * GAZETTEER_RECORD.size
+            if not country or self.data[offset + GAZETTEER_NAME_SIZE:offset + GAZETTEER_NAME_SIZE + 2] == country:
+                return low
+            low += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Get gazetteer statistics for monitoring."""
+        lookups = self.hits + self.misses
+        return {
+            "loaded": self.data is not None,
+            "names": self.count,
+            "mapped_bytes": len(self.data) if self.data is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+gazetteer = Gazetteer(GAZETTEER_PATH, GAZETTEER_MAX_MB * 1024 * 1024)
+
+# Typo-tolerant city lookups over the gazetteer's names
+FUZZY_MATCH_CONFIDENCE = float(os.getenv("FUZZY_MATCH_CONFIDENCE", 0.8))  # Use the best match when the geocoder finds nothing
+FUZZY_SUGGEST_CONFIDENCE = float(os.getenv("FUZZY_SUGGEST_CONFIDENCE", 0.6))  # Offer it in the "city not found" error
+FUZZY_MAX_CANDIDATES = 50  # Names per lookup ranked by edit distance
+FUZZY_MAX_LENGTH_DIFF = 2  # Names longer or shorter than this are not considered
+FUZZY_MAX_SUGGESTIONS = 3
+FUZZY_RECENT_SIZE = 1000  # Unknown cities whose matches are kept for the tool error
+
+def trigrams(name: str) -> set:
+    """Character trigrams of a name, padded so its start and end count."""
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Edits (insert, delete, substitute or swap neighbours) needed to turn a into b, or limit + 1 if more."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous, previous = [], list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+class CityNameIndex:
+    """Trigram index over the gazetteer's city names for typo-tolerant lookups.
+
+    A query's trigrams select the names of similar length sharing the most
+    of them, and those candidates are ranked by edit distance, so "lodnon"
+    finds "london" with confidence 1 - distance / length. Postings are kept
+    per trigram and name length, so a lookup only counts names within
+    FUZZY_MAX_LENGTH_DIFF characters of the query. Each distinct name is
+    indexed once and points at its most populous gazetteer record.
+    """
+
+    def __init__(self, max_candidates: int):
+        self.max_candidates = max_candidates
+        self.names: list = []  # name id -> normalized name
+        self.records = array("I")  # name id -> gazetteer record index
+        self.postings: Dict[tuple, array] = {}  # (trigram, name length) -> name ids
+        self.places: Optional[Gazetteer] = None
+        self.build_seconds = 0.0
+        self.corrected = 0
+        self.suggested = 0
+
+    def build(self, places: Gazetteer) -> None:
+        """Index every distinct name in the gazetteer (run in a worker thread)."""
+        start = time.perf_counter()
+        names, records, postings = [], array("I"), {}
+        previous = None
+        for index, name in places.names():
+            if name == previous:
+                continue  # Later records with the same name are less populous
+            previous = name
+            records.append(index)
+            for gram in trigrams(name):
+                posting = postings.get((gram, len(name)))
+                if posting is None:
+                    posting = postings[(gram, len(name))] = array("I")
+                posting.append(len(names))
+            names.append(name)
+        self.names, self.records, self.postings = names, records, postings
+        self.places = places
+        self.build_seconds = time.perf_counter() - start
+
+    def search(self, city: str, limit: int, min_confidence: float = 0.0) -> list:
+        """Closest known names to a city name, best first, as dicts with a 0-1 confidence.
+
+        A ",CC" suffix limits matches to cities in that country.
+        """
+        if self.places is None or self.places.data is None:
+            return []
+        name, _, country = city.partition(",")
+        query = normalize_city(name)
+        country = country.strip().upper().encode("ascii", "replace")
+        if not query or len(country) not in (0, 2):
+            return []
+        grams = trigrams(query)
+        lengths = range(max(len(query) - FUZZY_MAX_LENGTH_DIFF, 1), len(query) + FUZZY_MAX_LENGTH_DIFF + 1)
+        shared = collections.Counter(itertools.chain.from_iterable(
+            self.postings.get((gram, length), ()) for gram in grams for length in lengths
+        ))
+        max_distance = int((1 - min_confidence) * (len(query) + FUZZY_MAX_LENGTH_DIFF))
+        scored = []
+        for name_id, count in shared.most_common(self.max_candidates):
+            if len(grams) - count > 3 * max_distance:
+                break  # One edit changes at most three trigrams, so no closer names follow
+            name = self.names[name_id]
+            distance = edit_distance(query, name, max_distance)
+            confidence = 1 - distance / max(len(query), len(name))
+            if distance > max_distance or confidence < min_confidence:
+                continue
+            record = self.places.find(name.encode("utf-8"), country) if country else self.records[name_id]
+            if record is None:
+                continue  # No city of that name in the requested country
+            max_distance = min(max_distance, distance + 1)  # Names two edits worse than the best won't rank
+            code, lat, lon, population = self.places.entry(record)
+            scored.append((confidence, population, name, code, lat, lon))
+        scored.sort(reverse=True)
+        return [
+            {"name": name, "country": code, "confidence": round(confidence, 3), "coords": (lat, lon)}
+            for confidence, _, name, code, lat, lon in scored[:limit]
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get index statistics for monitoring."""
+        return {
+            "names": len(self.names),
+            "trigrams": len(self.postings),
+            "build_seconds": round(self.build_seconds, 3),
+            "corrected": self.corrected,
+            "suggested": self.suggested,
+        }
+
+city_index = CityNameIndex(FUZZY_MAX_CANDIDATES)
+
+fuzzy_recent: OrderedDict[str, list] = OrderedDict()  # normalized city -> matches
+
+async def fuzzy_matches(city: str) -> list:
+    """Close gazetteer names for a city the gazetteer has no exact match for, searched in a worker thread.
+
+    Matches are kept so city_not_found() can list them without searching again.
+    """
+    key = normalize_city(city)
+    matches = fuzzy_recent.get(key)
+    if matches is None:
+        if city_index.places is None:
+            return []  # Index still building
+        matches = await asyncio.to_thread(city_index.search, city, FUZZY_MAX_SUGGESTIONS, FUZZY_SUGGEST_CONFIDENCE)
+        fuzzy_recent[key] = matches
+    fuzzy_recent.move_to_end(key)
+    while len(fuzzy_recent) > FUZZY_RECENT_SIZE:
+        fuzzy_recent.popitem(last=False)
+    return matches
+
+def city_not_found(city: str) -> str:
+    """Tool error for an unknown city, suggesting close names found by get_coordinates()."""
+    message = f"Could not find coordinates for city: {city}"
+    suggestions = fuzzy_recent.get(normalize_city(city))
+    if suggestions:
+        city_index.suggested += 1
+        message += ". Did you mean: " + ", ".join(
+            f"{match['name'].title()}, {match['country']} ({match['confidence']:.0%})" for match in suggestions
+        ) + "?"
+    return message
+
+# Weather response cache configuration (seconds)
+WEATHER_CACHE_TTLS = {
+    "weather": float(os.getenv("WEATHER_CACHE_TTL", 600)),  # Current conditions refresh every ~10 minutes
+    "forecast": float(os.getenv("FORECAST_CACHE_TTL", 1800)),
+}
+WEATHER_CACHE_MAX_STALE = float(os.getenv("WEATHER_CACHE_MAX_STALE", 1800))
+WEATHER_CACHE_FALLBACK_AGE = float(os.getenv("WEATHER_CACHE_FALLBACK_AGE", 6 * 3600))  # Oldest data served when upstream fails
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", 5000))
+WEATHER_CACHE_DB = os.getenv("WEATHER_CACHE_DB", "")  # Shared SQLite file for multi-worker mode
+WEATHER_CACHE_PRECISION = 2  # Decimal places of lat/lon in cache keys (~1 km)
+WEATHER_CACHE_RADIUS_KM = float(os.getenv("WEATHER_CACHE_RADIUS_KM", 5))  # Serve fresh data this close on a miss, 0 disables
+KM_PER_DEGREE = 111.32  # Along a meridian
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(min(math.sqrt(a), 1.0))
+
+class WeatherCache:
+    """TTL cache of upstream weather responses with stale-while-revalidate.
+
+    Fresh entries are served directly. Entries past their TTL but within
+    max_stale seconds of it are served immediately while a background task
+    refreshes them. Anything older is treated as a miss, but is kept for up
+    to fallback_age seconds to stand in when the upstream call fails.
+
+    With a path, responses are also written to a SQLite file shared by all
+    worker processes, and lookup() checks it when the local copy is missing
+    or stale so a response fetched by one worker serves them all.
+
+    With a radius, entries are also indexed in a grid of radius-sized
+    cells, and get_nearby() answers a miss with the closest fresh entry
+    within radius_km, found by scanning the neighbouring cells.
+    """
+
+    def __init__(
+        self, ttls: Dict[str, float], max_stale: float, maxsize: int, fallback_age: float = 0.0,
+        path: str = "", radius_km: float = 0.0,
+    ):
+        self.ttls = ttls
+        self.max_stale = max_stale
+        self.maxsize = maxsize
+        self.fallback_age = fallback_age
+        self.path = path
+        self.radius_km = radius_km
+        self.cell_degrees = radius_km / KM_PER_DEGREE
+        self.cells: Dict[tuple, set] = {}  # (endpoint, units, row, column) -> keys
+        self.nearby_hits = 0
+        self.nearby_misses = 0
+        self.nearby_distance_total = 0.0
+        self.nearby_distance_max = 0.0
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+        self.entries: OrderedDict[tuple, tuple] = OrderedDict()  # key -> (data, fetched_at)
+        self.refresh_tasks: Dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fallback_hits = 0
+        self.shared_hits = 0
+
+    def open(self) -> None:
+        """Open the shared SQLite file and drop rows too old to serve."""
+        if not self.path or self.db is not None:
+            return
+        horizon = max([self.fallback_age] + [ttl + self.max_stale for ttl in self.ttls.values()])
+        self.db = open_shared_db(self.path)
+        with self.db_lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS weather (key TEXT PRIMARY KEY, data BLOB, fetched_at REAL)"
+            )
+            self.db.execute("DELETE FROM weather WHERE fetched_at <= ?", (time.time() - horizon,))
+            self.db.commit()
+
+    def close(self) -> None:
+        """Close the shared SQLite file."""
+        if self.db is not None:
+            with self.db_lock:
+                self.db.close()
+            self.db = None
+
+    def make_key(self, endpoint: str, lat: float, lon: float, units: str) -> tuple:
+        """Build a cache key from the endpoint, rounded coordinates and units."""
+        return (
+            endpoint,
+            round(lat, WEATHER_CACHE_PRECISION),
+            round(lon, WEATHER_CACHE_PRECISION),
+            units,
+        )
+
+    async def lookup(self, key: tuple) -> tuple:
+        """get(), first taking a newer copy from the shared file if the local one is missing or stale."""
+        if self.db is not None:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttls.get(key[0], 0):
+                await self.load(key)
+        return self.get(key)
+
+    async def load(self, key: tuple) -> None:
+        """Adopt the shared file's copy of key if it is newer than ours."""
+        row = await asyncio.to_thread(self.read, "|".join(map(str, key)))
+        if row is None:
+            return
+        data, fetched_wall = row
+        fetched_at = time.monotonic() - (time.time() - fetched_wall)  # Wall clock to this process's monotonic clock
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < fetched_at:
+            self.shared_hits += 1
+            self.remember(key, json_loads(data), fetched_at)
+
+    def read(self, db_key: str) -> Optional[tuple]:
+        """Read one row of the shared file."""
+        with self.db_lock:
+            if self.db is None:
+                return None
+            return self.db.execute("SELECT data, fetched_at FROM weather WHERE key = ?", (db_key,)).fetchone()
+
+    def expires_in(self, key: tuple) -> Optional[float]:
+        """Seconds until an entry goes stale (negative once it has), or None if it is not cached."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return self.ttls.get(key[0], 0) - (time.monotonic() - entry[1])
+
+    def get(self, key: tuple) -> tuple:
+        """Return (data, is_stale) for a servable entry, or (None, False) on a miss."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            data, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            ttl = self.ttls.get(key[0], 0)
+            if age <= ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data, False
+            if age <= ttl + self.max_stale:
+                self.entries.move_to_end(key)
+                self.stale_hits += 1
+                return data, True
+            if age > self.fallback_age:
+                del self.entries[key]
+                self.unindex(key)
+        self.misses += 1
+        return None, False
+
+    def cell_of(self, endpoint: str, units: str, lat: float, lon: float) -> tuple:
+        """Grid cell containing a point."""
+        return endpoint, units, math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def unindex(self, key: tuple) -> None:
+        """Remove a key from the grid."""
+        if self.radius_km <= 0:
+            return
+        cell = self.cell_of(key[0], key[3], key[1], key[2])
+        keys = self.cells.get(cell)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def get_nearby(self, key: tuple) -> Optional[tuple]:
+        """Return (data, key) of the closest fresh entry within radius_km of key's point, or None."""
+        if self.radius_km <= 0:
+            return None
+        endpoint, lat, lon, units = key
+        _, _, row, column = self.cell_of(endpoint, units, lat, lon)
+        # A cell spans fewer kilometres of longitude away from the equator, so scan more of them
+        columns = math.ceil(1 / max(math.cos(math.radians(lat)), 0.01))
+        now = time.monotonic()
+        ttl = self.ttls.get(endpoint, 0)
+        best = None
+        for cell_row in (row - 1, row, row + 1):
+            for cell_column in range(column - columns, column + columns + 1):
+                for other in self.cells.get((endpoint, units, cell_row, cell_column), ()):
+                    data, fetched_at = self.entries[other]
+                    if now - fetched_at > ttl:
+                        continue  # Only fresh data stands in for a neighbour
+                    distance = distance_km(lat, lon, other[1], other[2])
+                    if distance <= self.radius_km and (best is None or distance < best[0]):
+                        best = (distance, data, other)
+        if best is None:
+            self.nearby_misses += 1
+            return None
+        distance, data, other = best
+        self.nearby_hits += 1
+        self.nearby_distance_total += distance
+        self.nearby_distance_max = max(self.nearby_distance_max, distance)
+        self.entries.move_to_end(other)
+        return data, other
+
+    def get_fallback(self, key: tuple) -> tuple:
+        """Return (data, age) of an entry young enough to serve when upstream fails, or (None, 0)."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, 0.0
+        data, fetched_at = entry
+        age = time.monotonic() - fetched_at
+        if age > max(self.fallback_age, self.ttls.get(key[0], 0) + self.max_stale):
+            return None, 0.0
+        self.fallback_hits += 1
+        return data, age
+
+    async def set(self, key: tuple, data: Dict[str, Any]) -> None:
+        """Store a successful upstream response, writing it through to the shared file."""
+        self.remember(key, data, time.monotonic())
+        if self.db is not None:
+            await asyncio.to_thread(self.persist, "|".join(map(str, key)), data, time.time())
+
+    def remember(self, key: tuple, data: Dict[str, Any], fetched_at: float) -> None:
+        """Put an entry in memory, evicting the least recently used."""
+        if key not in self.entries and self.radius_km > 0:
+            self.cells.setdefault(self.cell_of(key[0], key[3], key[1], key[2]), set()).add(key)
+        self.entries[key] = (data, fetched_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            evicted, _ = self.entries.popitem(last=False)
+            self.unindex(evicted)
+
+    def import_entries(self, rows: list, clock_offset: float) -> int:
+        """Load [key, [data, fetched_at]] snapshot rows saved by a process whose wall clock ran clock_offset ahead of its monotonic one.
+
+        Rows keep their wall-clock age, so TTLs resume where they left off;
+        rows too old to serve even as a fallback, or older than what is
+        cached, are skipped.
+        """
+        clock_offset -= time.time() - time.monotonic()
+        horizon = max([self.fallback_age] + [ttl + self.max_stale for ttl in self.ttls.values()])
+        now = time.monotonic()
+        restored = 0
+        for key, (data, fetched_at) in rows:
+            key = tuple(key)
+            fetched_at += clock_offset
+            entry = self.entries.get(key)
+            if now - fetched_at > horizon or (entry is not None and entry[1] >= fetched_at):
+                continue
+            self.remember(key, data, fetched_at)
+            restored += 1
+        return restored
+
+    def persist(self, db_key: str, data: Dict[str, Any], fetched_at: float) -> None:
+        """Write one response to the shared file."""
+        with self.db_lock:
+            if self.db is None:
+                return
+            self.db.execute(
+                "INSERT OR REPLACE INTO weather (key, data, fetched_at) VALUES (?, ?, ?)",
+                (db_key, json_dumps(data), fetched_at),
+            )
+            self.db.commit()
+
+    def schedule_refresh(self, key: tuple, refresh) -> None:
+        """Run refresh() in the background unless one is already running for key."""
+        if key in self.refresh_tasks:
+            return
+        task = asyncio.create_task(refresh(), context=detached_context())
+        self.refresh_tasks[key] = task
+        task.add_done_callback(lambda _: self.refresh_tasks.pop(key, None))
+
+    def cancel_refreshes(self) -> None:
+        """Cancel all background refreshes (used on shutdown)."""
+        for task in list(self.refresh_tasks.values()):
+            task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics for monitoring."""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "fallback_hits": self.fallback_hits,
+            "shared_hits": self.shared_hits,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+            "refreshing": len(self.refresh_tasks),
+            "radius_km": self.radius_km,
+            "nearby_hits": self.nearby_hits,
+            "nearby_misses": self.nearby_misses,
+            "nearby_mean_km": round(self.nearby_distance_total / self.nearby_hits, 3) if self.nearby_hits else 0.0,
+            "nearby_max_km": round(self.nearby_distance_max, 3),
+        }
+
+weather_cache = WeatherCache(
+    WEATHER_CACHE_TTLS, WEATHER_CACHE_MAX_STALE, WEATHER_CACHE_SIZE, WEATHER_CACHE_FALLBACK_AGE,
+    WEATHER_CACHE_DB, WEATHER_CACHE_RADIUS_KM,
+)
+
+# Snapshots of the geocode and weather caches, restored on startup
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "cache_snapshot.bin")
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", 60))  # 0 saves only on shutdown
+CACHE_SNAPSHOT_VERSION = 1
+CACHE_SNAPSHOT_CHUNK = 5000  # Rows per encode call, so the saving thread hands the GIL back to the event loop often
+
+class CacheSnapshot:
+    """Periodic snapshot of the geocode and weather caches to one compressed file.
+
+    save() copies the entry lists on the event loop, then encodes them as
+    JSON, compresses them with zlib and atomically replaces the file in a
+    worker thread, in chunks so the event loop keeps running. The file is
+    zlib-compressed JSON lines: a header, then ["geocode", rows] and
+    ["weather", rows] chunks. restore() loads it at startup. Weather entries
+    keep their monotonic fetch times, and the file records the offset to
+    the wall clock, so restored TTLs count the time the server was down.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self.saves = 0
+        self.last_save_seconds = 0.0
+        self.last_size = 0
+        self.restored = {"geocode": 0, "weather": 0}
+
+    async def save(self) -> None:
+        """Write the current cache contents to the snapshot file."""
+        if not self.path:
+            return
+        geocode = list(geocode_cache.entries.items())
+        weather = list(weather_cache.entries.items())
+        start = time.perf_counter()
+        self.last_size = await asyncio.to_thread(self.write, geocode, weather)
+        self.last_save_seconds = time.perf_counter() - start
+        self.saves += 1
+
+    def write(self, geocode: list, weather: list) -> int:
+        """Encode and write a snapshot of (key, entry) lists; return its size in bytes."""
+        header = {
+            "version": CACHE_SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "clock_offset": time.time() - time.monotonic(),
+        }
+        compressor = zlib.compressobj(1)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"  # Workers may save at the same time
+        with open(tmp_path, "wb") as f:
+            f.write(compressor.compress(json_dumps(header) + b"\n"))
+            for name, rows in (("geocode", geocode), ("weather", weather)):
+                for start in range(0, len(rows), CACHE_SNAPSHOT_CHUNK):
+                    f.write(compressor.compress(json_dumps([name, rows[start:start + CACHE_SNAPSHOT_CHUNK]]) + b"\n"))
+            f.write(compressor.flush())
+            size = f.tell()
+        os.replace(tmp_path, self.path)
+        return size
+
+    def restore(self) -> None:
+        """Load the snapshot file into the caches (run before serving starts)."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        # Decoding allocates millions of small objects; pausing the cyclic GC meanwhile makes it several times faster
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self.path, "rb") as f:
+                header, *chunks = zlib.decompress(f.read()).splitlines()
+            header = json_loads(header)
+            if header.get("version") != CACHE_SNAPSHOT_VERSION:
+                return
+            restored = {"geocode": 0, "weather": 0}
+            for chunk in chunks:
+                name, rows = json_loads(chunk)
+                if name == "geocode":
+                    restored[name] += geocode_cache.import_entries(rows)
+                elif name == "weather":
+                    restored[name] += weather_cache.import_entries(rows, header["clock_offset"])
+            self.restored = restored
+        except (OSError, zlib.error, ValueError) as e:
+            log.warning("cache.snapshot_unreadable", path=self.path, error=str(e))
+            return
+        finally:
+            if gc_enabled:
+                gc.enable()
+        log.info("cache.snapshot_restored", age=round(time.time() - header["saved_at"]), **self.restored)
+
+    async def run(self) -> None:
+        """Save a snapshot every interval."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except OSError as e:
+                log.warning("cache.snapshot_failed", path=self.path, error=str(e))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get snapshot statistics for monitoring."""
+        return {
+            "path": self.path,
+            "saves": self.saves,
+            "last_save_seconds": round(self.last_save_seconds, 3),
+            "last_size_bytes": self.last_size,
+            "restored": self.restored,
+        }
+
+cache_snapshot = CacheSnapshot(CACHE_SNAPSHOT_PATH, CACHE_SNAPSHOT_INTERVAL)
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one shared task.
+
+    Every caller awaits the same task, so its result or exception reaches
+    all of them. A caller that is cancelled stops waiting without affecting
+    the others; the shared task is only cancelled once nobody is waiting.
+    The task runs without the first caller's request deadline, so a caller
+    in a hurry cannot cut the call short for the rest.
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, list] = {}  # key -> [task, waiters]
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, func):
+        """Await func() for key, joining an in-flight call if there is one."""
+        call = self.calls.get(key)
+        if call is None:
+            call = [asyncio.create_task(func(), context=detached_context()), 0]
+            self.calls[key] = call
+            call[0].add_done_callback(lambda task: self.finish(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                # Last waiter was cancelled; nobody needs the result any more
+                self.finish(key, call)
+                call[0].cancel()
+
+    def finish(self, key: str, call: list) -> None:
+        """Forget a finished or abandoned call."""
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        task = call[0]
+        if task.done() and not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter left
+
+    def stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics for monitoring."""
+        return {
+            "in_flight": len(self.calls),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+upstream_requests = SingleFlight()
+
+# Upstream rate limiting. OpenWeather counts calls per minute, so keep
+# UPSTREAM_RATE_LIMIT + UPSTREAM_BURST at or below the key's quota.
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", 55))  # Calls per minute, 0 disables
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", 5))
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", 5.0))  # Seconds a call may queue or back off
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 2))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", 0.25))
+UPSTREAM_RETRY_STATUSES = {429, 500, 502, 503, 504}
+PRIORITY_INTERACTIVE = 0  # Tool calls waiting on the answer
+PRIORITY_BACKGROUND = 1  # Stale-while-revalidate refreshes
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+class UpstreamBusyError(Exception):
+    """An upstream call could not get a rate limit token before its deadline."""
+
+    def __init__(self, wait: float):
+        super().__init__(f"OpenWeatherMap rate limit reached, try again in {wait:.0f}s")
+        self.wait = wait
+
+class UpstreamRateLimiter:
+    """Token bucket in front of all upstream calls, granting tokens by priority.
+
+    Calls take a token immediately when one is free and nobody is queued.
+    Otherwise they wait in a heap ordered by (priority, arrival), so
+    interactive calls overtake background refreshes. A call whose estimated
+    wait runs past its deadline fails straight away instead of queueing.
+    A 429 from upstream pauses the bucket for the Retry-After period.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiters: list = []  # heap of (priority, sequence, future, deadline)
+        self.sequence = itertools.count()
+        self.wake_handle: Optional[asyncio.TimerHandle] = None
+        self.granted = 0
+        self.queued = 0
+        self.rejected = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.throttled = 0
+
+    def refill(self, now: float) -> None:
+        """Add tokens for the time since the last refill, except while paused."""
+        start = max(self.updated, self.blocked_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def estimate_wait(self, priority: int, now: float) -> float:
+        """Seconds until a new call at this priority would get a token."""
+        ahead = sum(1 for waiter in self.waiters if waiter[0] <= priority and not waiter[2].done())
+        return max(self.blocked_until - now, 0.0) + max(ahead + 1 - self.tokens, 0.0) / self.rate
+
+    async def acquire(self, priority: int, deadline: float) -> None:
+        """Wait for a token, raising UpstreamBusyError if it cannot arrive by deadline."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.refill(now)
+        if not self.waiters and now >= self.blocked_until and self.tokens >= 1:
+            self.tokens -= 1
+            self.granted += 1
+            return
+        
+        wait = self.estimate_wait(priority, now)
+        if now + wait > deadline:
+            raise self.reject(priority, wait)
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future, deadline))
+        self.queued += 1
+        self.schedule_wake(now)
+        try:
+            await asyncio.wait_for(future, deadline - now)
+        except asyncio.TimeoutError:
+            # Overtaken by higher-priority calls
+            raise self.reject(priority, self.estimate_wait(priority, time.monotonic()))
+        self.granted += 1
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free right now; never queues."""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.refill(now)
+        if self.waiters or now < self.blocked_until or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.granted += 1
+        return True
+
+    def reject(self, priority: int, wait: float) -> UpstreamBusyError:
+        """Count a call that cannot get a token in time and build its error."""
+        self.rejected[PRIORITY_NAMES[priority]] += 1
+        return UpstreamBusyError(wait)
+
+    def schedule_wake(self, now: float) -> None:
+        """Arrange for wake() to run when the next token is due."""
+        if self.wake_handle is not None or not self.waiters:
+            return
+        delay = max(self.blocked_until - now, 0.0) + max(1 - self.tokens, 0.0) / self.rate
+        self.wake_handle = asyncio.get_running_loop().call_later(delay, self.wake)
+
+    def wake(self) -> None:
+        """Hand available tokens to the highest-priority waiters."""
+        self.wake_handle = None
+        now = time.monotonic()
+        self.refill(now)
+        while self.waiters and now >= self.blocked_until and self.tokens >= 1:
+            future = heapq.heappop(self.waiters)[2]
+            if not future.done():  # Skip callers that gave up
+                self.tokens -= 1
+                future.set_result(None)
+        while self.waiters and self.waiters[0][2].done():
+            heapq.heappop(self.waiters)
+        self.schedule_wake(now)
+
+    def pause(self, seconds: float) -> None:
+        """Stop granting tokens for a while after upstream throttled us."""
+        now = time.monotonic()
+        self.refill(now)
+        self.throttled += 1
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        for priority, _, future, deadline in self.waiters:
+            # Fail queued calls now rather than at their deadline
+            if deadline < self.blocked_until and not future.done():
+                future.set_exception(self.reject(priority, self.blocked_until - now))
+        if self.wake_handle is not None:
+            self.wake_handle.cancel()
+            self.wake_handle = None
+        self.schedule_wake(now)
+
+    def cancel(self) -> None:
+        """Fail all queued calls (used on shutdown)."""
+        if self.wake_handle is not None:
+            self.wake_handle.cancel()
+            self.wake_handle = None
+        for waiter in self.waiters:
+            waiter[2].cancel()
+        self.waiters = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Get rate limiting statistics for monitoring."""
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future, _ in self.waiters:
+            if not future.done():
+                queued[PRIORITY_NAMES[priority]] += 1
+        return {
+            "rate_per_minute": self.rate * 60,
+            "burst": self.capacity,
+            "tokens": round(self.tokens, 2),
+            "paused_for": round(max(self.blocked_until - time.monotonic(), 0.0), 2),
+            "queue_depth": queued,
+            "granted": self.granted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+        }
+
+# Each worker process gets an equal share of the key's quota
+upstream_limiter = UpstreamRateLimiter(UPSTREAM_RATE_LIMIT / MCP_WORKERS, UPSTREAM_BURST / MCP_WORKERS)
+
+# Circuit breaking and hedging of upstream calls
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))  # Consecutive failures before opening
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30.0))  # Seconds open before a probe call
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY_MS", 50)) / 1000
+HEDGE_MIN_SAMPLES = 20  # Successful calls needed before an endpoint's p95 is trusted
+HEDGE_WINDOW = 200  # Recent latencies kept per endpoint
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+class CircuitBreaker:
+    """Fail fast on an upstream endpoint that keeps failing.
+
+    Closed: calls go through, and consecutive failures (5xx, timeouts,
+    connection errors) are counted. Open: calls fail immediately for
+    reset_timeout seconds. Half-open: one probe call is let through; its
+    success closes the breaker and its failure opens it again.
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int, reset_timeout: float):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Return whether a call may be sent now."""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+        elif now - self.probe_started < self.reset_timeout:
+            self.rejected += 1  # A probe is already out
+            return False
+        self.probe_started = now
+        return True
+
+    def record_success(self) -> None:
+        """Reset the failure count, closing the breaker after a good probe."""
+        self.failures = 0
+        if self.state != "closed":
+            self.state = "closed"
+            log.info("upstream.circuit_closed", endpoint=self.endpoint)
+
+    def record_failure(self) -> None:
+        """Count a failure, opening the breaker at the threshold or on a failed probe."""
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opened += 1
+            log.warning("upstream.circuit_open", endpoint=self.endpoint, failures=self.failures)
+
+    def retry_in(self) -> float:
+        """Seconds until the breaker lets a probe through."""
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get breaker statistics for monitoring."""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """Return the breaker for an upstream endpoint, creating it on first use."""
+    breaker = circuit_breakers.get(endpoint)
+    if breaker is None:
+        breaker = circuit_breakers[endpoint] = CircuitBreaker(
+            endpoint, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+        )
+    return breaker
+
+class HedgePolicy:
+    """Decide when to send a second copy of a slow upstream call.
+
+    Keeps a window of recent successful latencies per endpoint and hedges
+    once a call has taken longer than that endpoint's p95. Counts which
+    attempt answered first so the win rate shows whether hedging pays off.
+    """
+
+    def __init__(self, enabled: bool, min_delay: float, min_samples: int, window: int):
+        self.enabled = enabled
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.latencies: Dict[str, deque] = {}
+        self.recorded: Dict[str, int] = {}
+        self.p95: Dict[str, float] = {}
+        self.hedged: Dict[str, int] = {}
+        self.wins: Dict[tuple, int] = {}  # (endpoint, "primary" | "hedge") -> count
+
+    def record(self, endpoint: str, latency: float) -> None:
+        """Add a call's latency, refreshing the p95 every 10 samples."""
+        samples = self.latencies.get(endpoint)
+        if samples is None:
+            samples = self.latencies[endpoint] = deque(maxlen=self.window)
+        samples.append(latency)
+        recorded = self.recorded[endpoint] = self.recorded.get(endpoint, 0) + 1
+        if len(samples) >= self.min_samples and (recorded % 10 == 0 or endpoint not in self.p95):
+            ordered = sorted(samples)
+            self.p95[endpoint] = ordered[int((len(ordered) - 1) * 0.95)]
+
+    def delay(self, endpoint: str) -> Optional[float]:
+        """Seconds to wait before hedging a call, or None to not hedge."""
+        if not self.enabled or endpoint not in self.p95:
+            return None
+        return max(self.p95[endpoint], self.min_delay)
+
+    def record_win(self, endpoint: str, attempt: str) -> None:
+        """Count which attempt of a hedged call answered."""
+        self.wins[endpoint, attempt] = self.wins.get((endpoint, attempt), 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hedging statistics for monitoring."""
+        endpoints = {}
+        for endpoint, hedged in self.hedged.items():
+            hedge_wins = self.wins.get((endpoint, "hedge"), 0)
+            endpoints[endpoint] = {
+                "hedged": hedged,
+                "hedge_wins": hedge_wins,
+                "primary_wins": self.wins.get((endpoint, "primary"), 0),
+                "hedge_win_rate": round(hedge_wins / hedged, 3) if hedged else 0.0,
+            }
+        return {
+            "enabled": self.enabled,
+            "p95_ms": {endpoint: round(p95 * 1000, 1) for endpoint, p95 in self.p95.items()},
+            "endpoints": endpoints,
+        }
+
+upstream_hedging = HedgePolicy(HEDGE_ENABLED, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, HEDGE_WINDOW)
+
+def is_error(data: Any) -> bool:
+    """Whether an upstream result is one of our error dicts."""
+    return isinstance(data, dict) and "error" in data
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter: between half and all of base * 2**attempt."""
+    delay = UPSTREAM_BACKOFF_BASE * 2 ** attempt
+    return delay / 2 + random.uniform(0, delay / 2)
+
+async def make_weather_request(url: str, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any] | None:
+    """Make a request to OpenWeatherMap API, sharing it with concurrent identical calls."""
+    return await upstream_requests.do(url, lambda: send_weather_request(url, priority))
+
+async def send_weather_request(url: str, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any] | None:
+    """Send a request to OpenWeatherMap within the rate limit, retrying throttled and transient failures."""
+    endpoint = upstream_endpoint(url)
+    breaker = get_circuit_breaker(endpoint)
+    deadline = time.monotonic() + UPSTREAM_MAX_WAIT
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            return {"error": f"OpenWeatherMap {endpoint} API is unavailable, retrying in {breaker.retry_in():.0f}s"}
+        try:
+            await upstream_limiter.acquire(priority, deadline)
+        except UpstreamBusyError as e:
+            return {"error": str(e)}
+        
+        data, retry_after = await send_hedged_attempt(url, endpoint)
+        if retry_after is None:
+            return data
+        delay = max(retry_after, backoff_delay(attempt))
+        if attempt >= UPSTREAM_MAX_RETRIES or time.monotonic() + delay > deadline:
+            return data
+        attempt += 1
+        upstream_retries.inc(endpoint)
+        log.info("upstream.retry", endpoint=endpoint, attempt=attempt, delay=round(delay, 3))
+        await asyncio.sleep(delay)
+
+async def send_hedged_attempt(url: str, endpoint: str) -> tuple:
+    """Send one attempt, racing a second copy if the first is slower than the endpoint's p95."""
+    delay = upstream_hedging.delay(endpoint)
+    if delay is None:
+        return await send_upstream_attempt(url)
     
-    if not data or "error" in data or not data:
+    primary = asyncio.create_task(send_upstream_attempt(url))
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done or not upstream_limiter.try_acquire():
+            return await primary  # Answered in time, or no quota to spare for a hedge
+        
+        hedge = asyncio.create_task(send_upstream_attempt(url))
+        pending.add(hedge)
+        upstream_hedging.hedged[endpoint] = upstream_hedging.hedged.get(endpoint, 0) + 1
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                data, retry_after = task.result()
+                # Prefer a good answer; take an error only once both attempts failed
+                if not is_error(data) or not pending:
+                    upstream_hedging.record_win(endpoint, "hedge" if task is hedge else "primary")
+                    return data, retry_after
+    finally:
+        for task in pending:
+            task.cancel()  # The losing attempt
+
+async def send_upstream_attempt(url: str) -> tuple:
+    """Send one request and return (data, retry_after); retry_after is None unless the call may be retried."""
+    global pool_waits
+    client = get_http_client()
+    endpoint = upstream_endpoint(url)
+    breaker = get_circuit_breaker(endpoint)
+    status = "error"
+    upstream_in_flight.inc()
+    start = time.perf_counter()
+    try:
+        pool = get_connection_pool()
+        if pool is not None and len(pool._requests) >= HTTP_MAX_CONNECTIONS:
+            pool_waits += 1  # This request will queue for a free connection
+        response = await client.get(url)
+        status = str(response.status_code)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        elif response.status_code != 429:
+            breaker.record_success()  # Upstream answered, even if with a client error
+        if response.status_code == 401:
+            return {"error": "Invalid API key. Please set a valid OpenWeatherMap API key."}, None
+        if response.status_code in UPSTREAM_RETRY_STATUSES:
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            if response.status_code == 429:
+                # Hold back every caller, not just this one
+                upstream_limiter.pause(retry_after if retry_after is not None else backoff_delay(0))
+                message = "OpenWeatherMap rate limit exceeded"
+                if retry_after is not None:
+                    message += f", try again in {retry_after:.0f}s"
+                return {"error": message}, retry_after or 0.0
+            return {"error": f"Request failed: upstream returned HTTP {response.status_code}"}, retry_after or 0.0
+        response.raise_for_status()
+        upstream_hedging.record(endpoint, time.perf_counter() - start)
+        return json_loads(response.content), None
+    except httpx.TimeoutException:
+        status = "timeout"
+        breaker.record_failure()
+        return {"error": "Request timeout"}, None
+    except httpx.TransportError as e:
+        breaker.record_failure()
+        return {"error": f"Request failed: {str(e)}"}, 0.0
+    except asyncio.CancelledError:
+        status = "cancelled"  # Lost a hedge race or the caller gave up
+        # Time so far is a lower bound; leaving it out would drag the p95 down once hedges win
+        upstream_hedging.record(endpoint, time.perf_counter() - start)
+        raise
+    except Exception as e:
+        return {"error": f"Request failed: {str(e)}"}, None
+    finally:
+        upstream_in_flight.dec()
+        upstream_latency.observe(time.perf_counter() - start, endpoint)
+        upstream_responses.inc(endpoint, status)
+
+async def get_coordinates(city: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[tuple]:
+    """Get latitude and longitude for a city."""
+    if priority == PRIORITY_INTERACTIVE:
+        geocode_cache.record_access(city)
+    # The gazetteer is checked before the SQLite file and the network; its hits need no caching
+    coords = geocode_cache.get(city) or gazetteer.lookup(city) or await geocode_cache.load(city)
+    if coords:
+        return coords
+    if geocode_cache.is_unknown(city):
         return None
     
-    if len(data) > 0:
-        return data[0]["lat"], data[0]["lon"]
+    # A name the gazetteer doesn't know exactly may be a typo of one it does
+    if priority == PRIORITY_INTERACTIVE:
+        matches = await fuzzy_matches(city)
+        if matches and matches[0]["confidence"] >= FUZZY_MATCH_CONFIDENCE:
+            city_index.corrected += 1
+            log.info("geocode.fuzzy_match", city=city, match=matches[0]["name"], confidence=matches[0]["confidence"])
+            coords = matches[0]["coords"]
+            await geocode_cache.set(city, coords)  # Repeats of the typo are cache hits
+            return coords
+    
+    url = f"{GEO_API_BASE}/direct?q={city}&limit=1&appid={API_KEY}"
+    data = await make_weather_request(url, priority)
+    
+    if data and not is_error(data):
+        coords = data[0]["lat"], data[0]["lon"]
+        await geocode_cache.set(city, coords)
+        return coords
+    if data == []:
+        geocode_cache.remember_unknown(city)
+    else:
+        # The geocoder failed rather than missed, so the name may well be right: suggest nothing
+        fuzzy_recent.pop(normalize_city(city), None)
     return None
 
+# Micro-batching of current-weather lookups into OpenWeather /group requests
+WEATHER_BATCH_WINDOW = float(os.getenv("WEATHER_BATCH_WINDOW_MS", 5)) / 1000
+WEATHER_GROUP_MAX_IDS = 20  # /group accepts at most 20 city IDs per request
+
+class WeatherBatcher:
+    """Batch concurrent current-weather lookups into OpenWeather /group requests.
+
+    /group takes city IDs rather than coordinates, so the batcher learns each
+    location's city ID from its first /weather response. Later lookups for
+    known locations wait up to the batching window and share one /group
+    request; lookups for unknown locations go straight to /weather.
+    """
+
+    def __init__(self, window: float, max_ids: int):
+        self.window = window
+        self.max_ids = max_ids
+        self.pending: list = []  # (city_id, units, priority, future)
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.send_tasks: set = set()
+        self.city_ids: Dict[tuple, int] = {}  # rounded (lat, lon) -> OpenWeather city ID
+        self.batch_sizes: Dict[int, int] = {}  # lookups per upstream request -> count
+
+    def location_key(self, lat: float, lon: float) -> tuple:
+        """Round coordinates the same way as weather cache keys."""
+        return round(lat, WEATHER_CACHE_PRECISION), round(lon, WEATHER_CACHE_PRECISION)
+
+    async def fetch(self, lat: float, lon: float, units: str, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any] | None:
+        """Fetch current weather for a location, batching it when possible."""
+        city_id = self.city_ids.get(self.location_key(lat, lon))
+        if self.window <= 0 or city_id is None:
+            return await self.fetch_single(lat, lon, units, priority)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((city_id, units, priority, future))
+        if self.flush_handle is None:
+            # A /group request serves many callers, so it runs without any one caller's deadline
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush, context=detached_context())
+        return await future
+
+    async def fetch_single(self, lat: float, lon: float, units: str, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any] | None:
+        """Fetch one location from /weather and remember its city ID."""
+        url = f"{OPENWEATHER_API_BASE}/weather?lat={lat}&lon={lon}&appid={API_KEY}&units={units}"
+        self.record_batch(1)
+        data = await make_weather_request(url, priority)
+        if data and "error" not in data and data.get("id"):
+            self.city_ids[self.location_key(lat, lon)] = data["id"]
+        return data
+
+    def flush(self) -> None:
+        """Send everything collected during the window as /group requests."""
+        self.flush_handle = None
+        pending, self.pending = self.pending, []
+        groups: Dict[str, Dict[int, list]] = {}
+        priorities: Dict[int, int] = {}  # city_id -> most urgent caller priority
+        for city_id, units, priority, future in pending:
+            if not future.done():  # Skip callers that were cancelled while waiting
+                groups.setdefault(units, {}).setdefault(city_id, []).append(future)
+                priorities[city_id] = min(priority, priorities.get(city_id, priority))
+        
+        for units, by_id in groups.items():
+            city_ids = list(by_id)
+            for i in range(0, len(city_ids), self.max_ids):
+                chunk = {city_id: by_id[city_id] for city_id in city_ids[i:i + self.max_ids]}
+                priority = min(priorities[city_id] for city_id in chunk)
+                task = asyncio.create_task(self.send_group(chunk, units, priority))
+                self.send_tasks.add(task)
+                task.add_done_callback(self.send_tasks.discard)
+
+    async def send_group(self, chunk: Dict[int, list], units: str, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Send one /group request and hand each caller its own city."""
+        ids = ",".join(str(city_id) for city_id in chunk)
+        url = f"{OPENWEATHER_API_BASE}/group?id={ids}&appid={API_KEY}&units={units}"
+        self.record_batch(sum(len(futures) for futures in chunk.values()))
+        try:
+            data = await make_weather_request(url, priority)
+        except BaseException as e:
+            for futures in chunk.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            raise
+        
+        if data and "error" not in data:
+            by_id = {item.get("id"): item for item in data.get("list", [])}
+        else:
+            by_id = {}
+        for city_id, futures in chunk.items():
+            result = by_id.get(city_id)
+            if result is None:
+                result = data if data and "error" in data else {"error": f"City {city_id} missing from group response"}
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+
+    def cancel(self) -> None:
+        """Cancel pending lookups and in-flight /group requests (used on shutdown)."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        for _, _, _, future in self.pending:
+            future.cancel()
+        self.pending = []
+        for task in list(self.send_tasks):
+            task.cancel()
+
+    def record_batch(self, size: int) -> None:
+        """Count how many lookups one upstream request served."""
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Get batching statistics for monitoring."""
+        requests = sum(self.batch_sizes.values())
+        lookups = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "window_ms": self.window * 1000,
+            "known_city_ids": len(self.city_ids),
+            "upstream_requests": requests,
+            "lookups": lookups,
+            "avg_batch_size": round(lookups / requests, 2) if requests else 0.0,
+            "max_batch_size": max(self.batch_sizes, default=0),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+weather_batcher = WeatherBatcher(WEATHER_BATCH_WINDOW, WEATHER_GROUP_MAX_IDS)
+
+# Startup cache warming and refresh-ahead of popular locations
+WARM_CITIES = [city.strip() for city in os.getenv("WARM_CITIES", "").split(",") if city.strip()]
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", 20))  # Most looked-up cities from the geocode cache's access stats
+WARM_CONCURRENCY = 4
+WARM_ENDPOINTS = ("weather", "forecast")
+REFRESH_AHEAD_INTERVAL = float(os.getenv("REFRESH_AHEAD_INTERVAL", 15))  # 0 disables
+REFRESH_AHEAD_LEAD = float(os.getenv("REFRESH_AHEAD_LEAD", 60))  # Refresh this long before an entry goes stale
+REFRESH_AHEAD_MIN_HITS = float(os.getenv("REFRESH_AHEAD_MIN_HITS", 3))
+REFRESH_AHEAD_HALF_LIFE = float(os.getenv("REFRESH_AHEAD_HALF_LIFE", 600))
+REFRESH_AHEAD_MAX_PER_CYCLE = int(os.getenv("REFRESH_AHEAD_MAX_PER_CYCLE", 10))
+
+class CacheWarmer:
+    """Warm the caches at startup and keep popular weather entries fresh.
+
+    warm() geocodes a list of cities and fetches their weather at
+    background priority. Afterwards, each interactive lookup adds one to
+    its cache key's score, and scores halve every half_life seconds. Every
+    interval, keys scoring at least min_hits whose entries go stale within
+    lead seconds (or have been evicted) are refreshed in the background,
+    hottest first and at most max_per_cycle at a time.
+    """
+
+    def __init__(self, interval: float, lead: float, min_hits: float, half_life: float, max_per_cycle: int, max_tracked: int):
+        self.interval = interval
+        self.lead = lead
+        self.min_hits = min_hits
+        self.half_life = half_life
+        self.max_per_cycle = max_per_cycle
+        self.max_tracked = max_tracked
+        self.scores: Dict[tuple, float] = {}  # cache key -> decayed lookup count
+        self.locations: Dict[tuple, tuple] = {}  # cache key -> (endpoint, lat, lon, units)
+        self.warm_cities = 0
+        self.warmed = 0
+        self.refreshed = 0
+
+    async def warm(self, cities: list) -> None:
+        """Geocode cities and cache their current weather and forecast."""
+        if not cities:
+            return
+        self.warm_cities = len(cities)
+        semaphore = asyncio.Semaphore(WARM_CONCURRENCY)
+
+        async def warm_city(city: str) -> None:
+            async with semaphore:
+                coords = await get_coordinates(city, PRIORITY_BACKGROUND)
+                if not coords:
+                    return
+                lat, lon = coords
+                await asyncio.gather(*(
+                    fetch_weather_data(endpoint, lat, lon, priority=PRIORITY_BACKGROUND) for endpoint in WARM_ENDPOINTS
+                ))
+                self.warmed += 1
+
+        await asyncio.gather(*(warm_city(city) for city in cities), return_exceptions=True)
+        log.info("cache.warmed", cities=len(cities), warmed=self.warmed)
+
+    def touch(self, key: tuple, location: tuple) -> None:
+        """Count an interactive lookup of a cache key."""
+        if not self.interval:
+            return
+        self.scores[key] = self.scores.get(key, 0.0) + 1
+        self.locations[key] = location
+
+    def decay(self, elapsed: float) -> None:
+        """Age scores by elapsed seconds, forgetting keys that are no longer looked up."""
+        factor = 0.5 ** (elapsed / self.half_life) if self.half_life > 0 else 0.0
+        ranked = sorted(self.scores.items(), key=lambda item: item[1], reverse=True)
+        self.scores = {}
+        for key, score in ranked[:self.max_tracked]:
+            if score * factor >= 0.05:
+                self.scores[key] = score * factor
+        for key in [key for key in self.locations if key not in self.scores]:
+            del self.locations[key]
+
+    def refresh_due(self) -> int:
+        """Start background refreshes for hot entries about to go stale; return how many started."""
+        hot = sorted(
+            (key for key, score in self.scores.items() if score >= self.min_hits),
+            key=self.scores.get,
+            reverse=True,
+        )
+        started = 0
+        for key in hot:
+            if started >= self.max_per_cycle:
+                break
+            expires_in = weather_cache.expires_in(key)
+            if key in weather_cache.refresh_tasks or (expires_in is not None and expires_in > self.lead):
+                continue
+            endpoint, lat, lon, units = self.locations[key]
+            weather_cache.schedule_refresh(
+                key, functools.partial(refresh_weather_data, endpoint, lat, lon, units, PRIORITY_BACKGROUND)
+            )
+            started += 1
+        self.refreshed += started
+        return started
+
+    async def run(self) -> None:
+        """Refresh hot entries ahead of expiry and persist city lookup counts, every interval."""
+        while True:
+            await asyncio.sleep(self.interval or 60)
+            if self.interval:
+                self.decay(self.interval)
+                self.refresh_due()
+            try:
+                await geocode_cache.flush_accesses()
+            except sqlite3.Error as e:
+                log.warning("cache.access_flush_failed", error=str(e))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get warming and refresh-ahead statistics for monitoring."""
+        return {
+            "warm_cities": self.warm_cities,
+            "warmed": self.warmed,
+            "tracked_keys": len(self.scores),
+            "hot_keys": sum(1 for score in self.scores.values() if score >= self.min_hits),
+            "refreshed_ahead": self.refreshed,
+        }
+
+cache_warmer = CacheWarmer(
+    REFRESH_AHEAD_INTERVAL, REFRESH_AHEAD_LEAD, REFRESH_AHEAD_MIN_HITS,
+    REFRESH_AHEAD_HALF_LIFE, REFRESH_AHEAD_MAX_PER_CYCLE, WEATHER_CACHE_SIZE,
+)
+
+def warm_city_list() -> list:
+    """WARM_CITIES followed by the most looked-up cities, without duplicates."""
+    cities = {}
+    for city in WARM_CITIES + geocode_cache.top_cities(WARM_TOP_N):
+        cities.setdefault(normalize_city(city), city)
+    return list(cities.values())
+
+async def refresh_weather_data(endpoint: str, lat: float, lon: float, units: str, priority: int) -> Dict[str, Any] | None:
+    """Fetch an OpenWeatherMap data endpoint for a location and store a good response in the cache."""
+    if endpoint == "weather":
+        data = await weather_batcher.fetch(lat, lon, units, priority)
+    else:
+        url = f"{OPENWEATHER_API_BASE}/{endpoint}?lat={lat}&lon={lon}&appid={API_KEY}&units={units}"
+        data = await make_weather_request(url, priority)
+    if data and "error" not in data:
+        await weather_cache.set(weather_cache.make_key(endpoint, lat, lon, units), data)
+    return data
+
+async def fetch_weather_data(
+    endpoint: str, lat: float, lon: float, units: str = "metric", priority: int = PRIORITY_INTERACTIVE
+) -> Dict[str, Any] | None:
+    """Fetch an OpenWeatherMap data endpoint for a location through the response cache."""
+    key = weather_cache.make_key(endpoint, lat, lon, units)
+    data, is_stale = await weather_cache.lookup(key)
+    if data is None:
+        nearby = weather_cache.get_nearby(key)
+        if nearby is not None:
+            # Fresh data from a few kilometres away answers; keep that entry hot rather than this one
+            data, nearby_key = nearby
+            if priority == PRIORITY_INTERACTIVE:
+                cache_warmer.touch(nearby_key, nearby_key)
+            return data
+    
+    if priority == PRIORITY_INTERACTIVE:
+        cache_warmer.touch(key, (endpoint, lat, lon, units))
+    if data is not None:
+        if is_stale:
+            # Background refreshes yield upstream quota to interactive calls
+            weather_cache.schedule_refresh(
+                key, functools.partial(refresh_weather_data, endpoint, lat, lon, units, PRIORITY_BACKGROUND)
+            )
+        return data
+    
+    data = await refresh_weather_data(endpoint, lat, lon, units, priority)
+    if not data or "error" in data:
+        # Upstream is failing or its breaker is open; fall back to older data if we have it
+        cached, age = weather_cache.get_fallback(key)
+        if cached is not None:
+            return dict(cached, fallback_age=age)
+    return data
+
+def observation_from(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a metric /weather response into the observation the current-weather tools share."""
+    weather = data["weather"][0]
+    main = data["main"]
+    wind = data.get("wind", {})
+    return {
+        "temp_c": main["temp"],
+        "feels_like_c": main["feels_like"],
+        "humidity": main["humidity"],
+        "pressure_hpa": main["pressure"],
+        "wind_speed_ms": wind.get("speed", 0),
+        "condition": weather["main"],
+        "description": weather["description"],
+        "visibility_m": data.get("visibility"),
+        "fallback_age": data.get("fallback_age"),
+    }
+
+# Parsed forecasts, reused while the cached upstream response is unchanged
+FORECAST_SERIES_CACHE_SIZE = 1000
+FORECAST_MIN_DAY_SLOTS = 4  # 3-hour slots a day needs to be summarized; fewer is a partial first or last day
+
+class ForecastSeries:
+    """A 5 day / 3 hour forecast as NumPy columns, summarized per day.
+
+    The upstream slots are parsed once into time, temperature, humidity,
+    wind and condition code arrays. Slots arrive in time order, so each
+    local calendar day is a contiguous run, and the daily min/max/mean and
+    dominant condition are computed with reduceat over those runs. The
+    forecast starts and ends mid-day, so days with fewer than
+    FORECAST_MIN_DAY_SLOTS slots are left out of the summary.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        items = data["list"]
+        count = len(items)
+        utc_offset = data.get("city", {}).get("timezone", 0)
+        self.time = np.fromiter((item["dt"] for item in items), dtype=np.int64, count=count)
+        self.temp = np.fromiter((item["main"]["temp"] for item in items), dtype=np.float64, count=count)
+        self.humidity = np.fromiter((item["main"]["humidity"] for item in items), dtype=np.float64, count=count)
+        self.wind = np.fromiter((item.get("wind", {}).get("speed", 0) for item in items), dtype=np.float64, count=count)
+        self.code = np.fromiter((item["weather"][0]["id"] for item in items), dtype=np.int32, count=count)
+        self.descriptions = {item["weather"][0]["id"]: item["weather"][0]["description"] for item in items}
+        
+        day = (self.time + utc_offset) // 86400
+        starts = np.flatnonzero(np.diff(day, prepend=day[:1] - 1))  # First slot of each day
+        slots = np.diff(np.append(starts, count))
+        self.days = day[starts]
+        self.slots = slots
+        self.temp_min = np.minimum.reduceat(self.temp, starts)
+        self.temp_max = np.maximum.reduceat(self.temp, starts)
+        self.temp_mean = np.add.reduceat(self.temp, starts) / slots
+        self.humidity_mean = np.add.reduceat(self.humidity, starts) / slots
+        self.wind_max = np.maximum.reduceat(self.wind, starts)
+        # Dominant condition: the code with the most slots in each day
+        codes, code_index = np.unique(self.code, return_inverse=True)
+        day_index = np.repeat(np.arange(len(starts)), slots)
+        tally = np.zeros((len(starts), len(codes)), dtype=np.int32)
+        np.add.at(tally, (day_index, code_index), 1)
+        self.dominant = codes[tally.argmax(axis=1)]
+
+    def daily_lines(self, days: int) -> list:
+        """One summary line for each of the first days days, skipping partial days."""
+        lines = []
+        complete = np.flatnonzero(self.slots >= FORECAST_MIN_DAY_SLOTS)
+        if not len(complete):
+            complete = np.arange(len(self.days))  # A short forecast; summarize what there is
+        for i in complete[:days]:
+            date = time.strftime("%Y-%m-%d", time.gmtime(int(self.days[i]) * 86400))
+            lines.append(
+                f"{date}: {self.temp_min[i]:.1f} to {self.temp_max[i]:.1f}°C (avg {self.temp_mean[i]:.1f}°C), "
+                f"{self.descriptions[int(self.dominant[i])]}, humidity {self.humidity_mean[i]:.0f}%, "
+                f"wind up to {self.wind_max[i]:.1f} m/s"
+            )
+        return lines
+
+forecast_series_cache: OrderedDict[tuple, tuple] = OrderedDict()  # weather cache key -> (response, ForecastSeries)
+
+def forecast_series(key: tuple, data: Dict[str, Any]) -> ForecastSeries:
+    """Parsed forecast for a response, parsing only when the cached response has changed."""
+    entry = forecast_series_cache.get(key)
+    if entry is None or entry[0] is not data:
+        entry = (data, ForecastSeries(data))
+        forecast_series_cache[key] = entry
+    forecast_series_cache.move_to_end(key)
+    while len(forecast_series_cache) > FORECAST_SERIES_CACHE_SIZE:
+        forecast_series_cache.popitem(last=False)
+    return entry[1]
+
+async def get_observation(city: str) -> Dict[str, Any]:
+    """Current conditions for a city in metric units, or {"error": message}.
+
+    get_weather, get_weather_alerts and compare_weather all read this, so
+    they share one cached /weather response per location.
+    """
+    coords = await get_coordinates(city)
+    if not coords:
+        return {"error": city_not_found(city)}
+    
+    lat, lon = coords
+    data = await fetch_weather_data("weather", lat, lon)
+    if not data or "error" in data:
+        return {"error": f"Error fetching weather for {city}: {(data or {}).get('error', 'Unknown error')}"}
+    return observation_from(data)
+
+def fallback_note(data: Dict[str, Any]) -> str:
+    """Line added to tool output when cached data stood in for a failed upstream call."""
+    age = data.get("fallback_age")
+    if age is None:
+        return ""
+    return f"\nNote: weather service unavailable, showing data from {age / 60:.0f} minutes ago"
+
+# Multi-city comparison limits
+COMPARE_MAX_CITIES = 20
+COMPARE_MAX_CONCURRENCY = int(os.getenv("COMPARE_MAX_CONCURRENCY", 8))
+
 @mcp.tool()
 async def get_current_time() -> str:
     """Get the current time in a human-readable format."""
@@ -76,28 +2241,17 @@ async def get_weather(city: str) -> str:
     Args:
         city: Name of the city (e.g., 'London', 'New York', 'Tokyo')
     """
-    coords = await get_coordinates(city)
-    if not coords:
-        return f"Could not find coordinates for city: {city}"
-    
-    lat, lon = coords
-    url = f"{OPENWEATHER_API_BASE}/weather?lat={lat}&lon={lon}&appid={API_KEY}&units=metric"
-    data = await make_weather_request(url)
-    
-    if not data or "error" in data:
-        return f"Error fetching weather: {data.get('error', 'Unknown error')}"
-    
-    weather = data["weather"][0]
-    main = data["main"]
-    wind = data.get("wind", {})
+    observation = await get_observation(city)
+    if "error" in observation:
+        return observation["error"]
     
     return f"""Weather in {city}:
-Temperature: {main['temp']}�C (feels like {main['feels_like']}�C)
-Condition: {weather['main']} - {weather['description']}
-Humidity: {main['humidity']}%
-Pressure: {main['pressure']} hPa
-Wind: {wind.get('speed', 'N/A')} m/s
-Visibility: {data.get('visibility', 'N/A')} meters"""
+Temperature: {observation['temp_c']}�C (feels like {observation['feels_like_c']}�C)
+Condition: {observation['condition']} - {observation['description']}
+Humidity: {observation['humidity']}%
+Pressure: {observation['pressure_hpa']} hPa
+Wind: {observation['wind_speed_ms']} m/s
+Visibility: {observation['visibility_m'] or 'N/A'} meters""" + fallback_note(observation)
 
 @mcp.tool()
 async def get_forecast(city: str, days: int = 3) -> str:
@@ -112,30 +2266,18 @@ async def get_forecast(city: str, days: int = 3) -> str:
     
     coords = await get_coordinates(city)
     if not coords:
-        return f"Could not find coordinates for city: {city}"
+        return city_not_found(city)
     
     lat, lon = coords
-    url = f"{OPENWEATHER_API_BASE}/forecast?lat={lat}&lon={lon}&appid={API_KEY}&units=metric"
-    data = await make_weather_request(url)
+    data = await fetch_weather_data("forecast", lat, lon)
     
     if not data or "error" in data:
-        return f"Error fetching forecast: {data.get('error', 'Unknown error')}"
+        return f"Error fetching forecast: {(data or {}).get('error', 'Unknown error')}"
+    if not data.get("list"):
+        return f"No forecast available for {city}"
     
-    forecasts = []
-    count = 0
-    for item in data["list"]:
-        if count >= days * 8:  # 8 forecasts per day (3-hour intervals)
-            break
-        
-        dt = item["dt_txt"]
-        weather = item["weather"][0]
-        main = item["main"]
-        
-        forecast = f"{dt}: {main['temp']}�C, {weather['description']}"
-        forecasts.append(forecast)
-        count += 1
-    
-    return f"Forecast for {city} (next {days} days):\n" + "\n".join(forecasts[:days*2])  # Show 2 times per day
+    series = forecast_series(weather_cache.make_key("forecast", lat, lon, "metric"), data)
+    return f"Forecast for {city} (next {days} days):\n" + "\n".join(series.daily_lines(days)) + fallback_note(data)
 
 @mcp.tool()
 async def get_weather_alerts(city: str) -> str:
@@ -144,22 +2286,15 @@ async def get_weather_alerts(city: str) -> str:
     Args:
         city: Name of the city
     """
-    coords = await get_coordinates(city)
-    if not coords:
-        return f"Could not find coordinates for city: {city}"
-    
-    lat, lon = coords
-    url = f"{OPENWEATHER_API_BASE}/weather?lat={lat}&lon={lon}&appid={API_KEY}"
-    data = await make_weather_request(url)
-    
-    if not data or "error" in data:
-        return f"Error fetching weather data: {data.get('error', 'Unknown error')}"
+    observation = await get_observation(city)
+    if "error" in observation:
+        return observation["error"]
     
     # Check for extreme weather conditions
     alerts = []
-    weather = data["weather"][0]["main"].lower()
-    temp = data["main"]["temp"]
-    wind_speed = data.get("wind", {}).get("speed", 0)
+    weather = observation["condition"].lower()
+    temp = observation["temp_c"]
+    wind_speed = observation["wind_speed_ms"]
     
     if "storm" in weather or "thunderstorm" in weather:
         alerts.append("� Thunderstorm alert")
@@ -171,59 +2306,82 @@ async def get_weather_alerts(city: str) -> str:
         alerts.append("=� High wind warning")
     
     if alerts:
-        return f"Weather alerts for {city}:\n" + "\n".join(alerts)
+        return f"Weather alerts for {city}:\n" + "\n".join(alerts) + fallback_note(observation)
     else:
-        return f"No weather alerts for {city}"
+        return f"No weather alerts for {city}" + fallback_note(observation)
+
+async def fetch_city_weather(city: str, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Geocode a city and fetch its current weather, bounded by semaphore."""
+    async with semaphore:
+        observation = await get_observation(city)
+    
+    if "error" in observation:
+        return {"city": city, "error": observation["error"]}
+    
+    return {
+        "city": city,
+        "temp": observation["temp_c"],
+        "humidity": observation["humidity"],
+        "wind_speed": observation["wind_speed_ms"],
+        "description": observation["description"],
+    }
 
 @mcp.tool()
-async def compare_cities_weather(city1: str, city2: str) -> str:
-    """Compare weather between two cities.
+async def compare_weather(cities: list[str]) -> str:
+    """Compare current weather across several cities.
     
     Args:
-        city1: First city name
-        city2: Second city name
+        cities: List of city names to compare (2-20)
     """
-    # Get weather for both cities
-    coords1 = await get_coordinates(city1)
-    coords2 = await get_coordinates(city2)
-    
-    if not coords1:
-        return f"Could not find coordinates for city: {city1}"
-    if not coords2:
-        return f"Could not find coordinates for city: {city2}"
-    
-    lat1, lon1 = coords1
-    lat2, lon2 = coords2
+    if len(cities) < 2 or len(cities) > COMPARE_MAX_CITIES:
+        return f"Provide between 2 and {COMPARE_MAX_CITIES} cities to compare"
     
-    url1 = f"{OPENWEATHER_API_BASE}/weather?lat={lat1}&lon={lon1}&appid={API_KEY}&units=metric"
-    url2 = f"{OPENWEATHER_API_BASE}/weather?lat={lat2}&lon={lon2}&appid={API_KEY}&units=metric"
+    # Geocode and fetch all cities concurrently
+    semaphore = asyncio.Semaphore(COMPARE_MAX_CONCURRENCY)
+    results = await asyncio.gather(*(fetch_city_weather(city, semaphore) for city in cities))
     
-    data1 = await make_weather_request(url1)
-    data2 = await make_weather_request(url2)
+    errors = [result["error"] for result in results if "error" in result]
+    found = [result for result in results if "error" not in result]
+    if len(found) < 2:
+        return "\n".join(errors)
     
-    if not data1 or "error" in data1:
-        return f"Error fetching weather for {city1}"
-    if not data2 or "error" in data2:
-        return f"Error fetching weather for {city2}"
+    lines = ["Weather comparison:"]
+    for result in found:
+        lines.append(
+            f"{result['city']}: {result['temp']}°C, {result['description']}, "
+            f"humidity {result['humidity']}%, wind {result['wind_speed']} m/s"
+        )
     
-    temp1 = data1["main"]["temp"]
-    temp2 = data2["main"]["temp"]
-    desc1 = data1["weather"][0]["description"]
-    desc2 = data2["weather"][0]["description"]
+    warmest = max(found, key=lambda result: result["temp"])
+    coolest = min(found, key=lambda result: result["temp"])
+    windiest = max(found, key=lambda result: result["wind_speed"])
+    most_humid = max(found, key=lambda result: result["humidity"])
     
-    temp_diff = abs(temp1 - temp2)
-    warmer_city = city1 if temp1 > temp2 else city2
+    lines.append("")
+    lines.append(f"Warmest: {warmest['city']} ({warmest['temp']}°C)")
+    lines.append(f"Windiest: {windiest['city']} ({windiest['wind_speed']} m/s)")
+    lines.append(f"Most humid: {most_humid['city']} ({most_humid['humidity']}%)")
+    lines.append(f"{warmest['city']} is warmer than {coolest['city']} by {warmest['temp'] - coolest['temp']:.1f}°C")
     
-    return f"""Weather comparison:
-{city1}: {temp1}�C, {desc1}
-{city2}: {temp2}�C, {desc2}
+    if errors:
+        lines.append("")
+        lines.extend(errors)
+    return "\n".join(lines)
 
-{warmer_city} is warmer by {temp_diff:.1f}�C"""
+@mcp.tool()
+async def compare_cities_weather(city1: str, city2: str) -> str:
+    """Compare weather between two cities.
+    
+    Args:
+        city1: First city name
+        city2: Second city name
+    """
+    return await compare_weather([city1, city2])
 
 @mcp.tool()
 async def get_server_info() -> str:
     """Get information about this MCP server."""
-    return json.dumps({
+    return json_dumps({
         "name": "weather-test-server",
         "version": "1.0.0",
         "description": "MCP server with weather and forecast functionality",
@@ -234,460 +2392,551 @@ async def get_server_info() -> str:
             "get_weather", 
             "get_forecast", 
             "get_weather_alerts",
+            "compare_weather",
             "compare_cities_weather",
             "get_server_info"
         ],
         "note": "Weather data requires valid OpenWeatherMap API key",
         "api_key_status": "configured" if API_KEY != "demo" else "demo_mode"
-    }, indent=2)
+    }, indent=True).decode()
 
 @mcp.tool()
 async def health_check() -> str:
     """Health check endpoint for server monitoring."""
-    return json.dumps({
+    return json_dumps({
         "status": "healthy",
         "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
         "server": "weather-test-server",
         "api_available": API_KEY != "demo"
-    })
+    }).decode()
+
+# Tool schemas and capabilities, derived once from the FastMCP tool registry
+SERVER_INFO = {
+    "name": "weather-test-server",
+    "version": "1.0.0",
+    "description": "Enhanced MCP weather server with forecast functionality"
+}
+SERVER_CAPABILITIES = {"tools": {"listChanged": False}}
+
+def build_tool_schemas() -> list:
+    """Build tools/list entries from the registered @mcp.tool() functions.
+    
+    The description is the first docstring paragraph, and each "Args:" line
+    of the docstring becomes the description of its input property.
+    """
+    schemas = []
+    for tool in mcp._tool_manager.list_tools():
+        summary, _, rest = re.sub(r"\n\s*\n", "\n\n", (tool.description or "").strip()).partition("\n\n")
+        arg_docs = {}
+        for line in rest.split("Args:", 1)[-1].splitlines() if "Args:" in rest else []:
+            name, sep, doc = line.strip().partition(":")
+            if sep and name:
+                arg_docs[name.strip()] = doc.strip()
+        
+        properties = {}
+        for name, prop in tool.parameters.get("properties", {}).items():
+            prop = {key: value for key, value in prop.items() if key != "title"}
+            if name in arg_docs:
+                prop["description"] = arg_docs[name]
+            properties[name] = prop
+        
+        schemas.append({
+            "name": tool.name,
+            "description": " ".join(summary.split()).rstrip("."),
+            "inputSchema": {
+                "type": "object",
+                "properties": properties,
+                "required": tool.parameters.get("required", [])
+            }
+        })
+    return schemas
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag for a response body."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+TOOL_SCHEMAS = build_tool_schemas()
+TOOLS_LIST_BODY = json_dumps({"tools": TOOL_SCHEMAS})
+CAPABILITIES_BODY = json_dumps({
+    "jsonrpc": "2.0",
+    "id": 1,
+    "result": {
+        "protocolVersion": "2025-06-18",
+        "capabilities": SERVER_CAPABILITIES,
+        "serverInfo": SERVER_INFO,
+        "tools": TOOL_SCHEMAS
+    }
+})
+CAPABILITIES_ETAG = make_etag(CAPABILITIES_BODY)
+
+# JSON-RPC dispatch tables, registered once at import time
+class RPCError(Exception):
+    """A JSON-RPC error to return to the client."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+RPC_METHODS: Dict[str, Any] = {}
+RPC_MAX_BATCH_SIZE = int(os.getenv("RPC_MAX_BATCH_SIZE", 50))
+RPC_BATCH_CONCURRENCY = int(os.getenv("RPC_BATCH_CONCURRENCY", 8))
+JSON_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+def rpc_method(name: str):
+    """Register a JSON-RPC method handler."""
+    def register(handler):
+        RPC_METHODS[name] = handler
+        return handler
+    return register
+
+def compile_validator(schema: Dict[str, Any]):
+    """Compile a tool input schema into a fast argument checker."""
+    properties = schema.get("properties", {})
+    required = tuple(schema.get("required", []))
+    checks = {}
+    for name, prop in properties.items():
+        items = prop.get("items", {})
+        checks[name] = (prop.get("type"), JSON_TYPES.get(prop.get("type")), JSON_TYPES.get(items.get("type")))
+    
+    def validate(arguments: Any) -> Dict[str, Any]:
+        if not isinstance(arguments, dict):
+            raise RPCError(-32602, "Invalid params: arguments must be an object")
+        for name in required:
+            if name not in arguments:
+                raise RPCError(-32602, f"Invalid params: missing required argument '{name}'")
+        for name, value in arguments.items():
+            check = checks.get(name)
+            if check is None:
+                raise RPCError(-32602, f"Invalid params: unexpected argument '{name}'")
+            type_name, expected, item_type = check
+            if expected is None:
+                continue
+            if not isinstance(value, expected) or (isinstance(value, bool) and type_name != "boolean"):
+                raise RPCError(-32602, f"Invalid params: '{name}' must be of type {type_name}")
+            if item_type is not None and not all(isinstance(item, item_type) for item in value):
+                raise RPCError(-32602, f"Invalid params: items of '{name}' have the wrong type")
+        return arguments
+    
+    return validate
+
+def can_suspend(function) -> bool:
+    """Whether a tool can wait on anything; one that can't finishes before any deadline could cancel it."""
+    if not asyncio.iscoroutinefunction(function):
+        return True  # A wrapper returning an awaitable; assume the worst
+    return any(instruction.opname in ("YIELD_VALUE", "YIELD_FROM") for instruction in dis.get_instructions(function))
+
+TOOL_HANDLERS = {
+    schema["name"]: (tool.fn, compile_validator(schema["inputSchema"]), can_suspend(tool.fn))
+    for tool, schema in zip(mcp._tool_manager.list_tools(), TOOL_SCHEMAS)
+}
+
+@rpc_method("initialize")
+async def rpc_initialize(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Handle MCP initialization."""
+    return {
+        "protocolVersion": params.get("protocolVersion", "2024-11-05"),  # Use client's version
+        "capabilities": SERVER_CAPABILITIES,
+        "serverInfo": SERVER_INFO
+    }
+
+@rpc_method("notifications/initialized")
+async def rpc_initialized(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Handle the MCP initialization notification."""
+    return {}
+
+@rpc_method("tools/list")
+async def rpc_tools_list(params: Dict[str, Any]) -> bytes:
+    """Return the pre-serialized tool list."""
+    return TOOLS_LIST_BODY
+
+@rpc_method("tools/call")
+async def rpc_tools_call(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate arguments and call a registered tool."""
+    tool_name = params.get("name")
+    handler = TOOL_HANDLERS.get(tool_name)
+    if handler is None:
+        raise RPCError(-32601, f"Tool not found: {tool_name}")
+    
+    tool_function, validate, suspends = handler
+    tool_calls.inc(tool_name)
+    start = time.perf_counter()
+    budget = tool_call_budget(params) if suspends else None
+    try:
+        arguments = validate(params.get("arguments") or {})
+        try:
+            if budget is None:
+                result = await tool_function(**arguments)  # Nothing to cancel it at, so no timer to arm
+            else:
+                async with asyncio.timeout(budget):
+                    result = await tool_function(**arguments)
+        except TimeoutError as e:
+            if budget is None:
+                raise RPCError(-32603, f"Tool execution error: {str(e)}")
+            deadline_exceeded.inc(tool_name)
+            raise RPCError(-32603, f"Tool execution error: deadline of {budget:.1f}s exceeded")
+        except Exception as e:
+            raise RPCError(-32603, f"Tool execution error: {str(e)}")
+    except RPCError:
+        tool_errors.inc(tool_name)
+        raise
+    finally:
+        tool_latency.observe(time.perf_counter() - start, tool_name)
+    return {"content": [{"type": "text", "text": result}]}
+
+def tool_call_budget(params: Dict[str, Any]) -> float:
+    """Set the deadline for a tool call and return its seconds: the request's, or sooner if _meta.timeout asks."""
+    now = time.monotonic()
+    deadline = request_deadline.get()
+    if deadline is None:
+        deadline = now + REQUEST_TIMEOUT
+    meta = params.get("_meta")
+    timeout = parse_timeout(meta.get("timeout")) if isinstance(meta, dict) else None
+    if timeout is not None:
+        deadline = min(deadline, now + timeout)
+    request_deadline.set(deadline)
+    return max(deadline - now, 0.0)
+
+def encode_rpc_result(request_id: Any, result: Any) -> bytes:
+    """Encode a JSON-RPC result; bytes results are spliced in pre-serialized."""
+    if isinstance(result, bytes):
+        return b'{"jsonrpc":"2.0","id":' + json_dumps(request_id) + b',"result":' + result + b"}"
+    return json_dumps({"jsonrpc": "2.0", "id": request_id, "result": result})
+
+def encode_rpc_error(request_id: Any, code: int, message: str) -> bytes:
+    """Encode a JSON-RPC error response."""
+    return json_dumps({"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}})
+
+def is_notification(message: Dict[str, Any], in_batch: bool = False) -> bool:
+    """Notifications carry no id and get no response.
+
+    Batch entries follow JSON-RPC 2.0: any entry without an id is a
+    notification. A lone message without one is still answered (as id 1)
+    unless it is a notifications/ method, as older clients expect.
+    """
+    if "id" in message:
+        return False
+    return in_batch or str(message.get("method", "")).startswith("notifications/")
+
+async def dispatch_batch(messages: list) -> Optional[bytes]:
+    """Run a JSON-RPC batch concurrently and return the responses in request order."""
+    if not messages:
+        return encode_rpc_error(None, -32600, "Invalid Request: empty batch")
+    if len(messages) > RPC_MAX_BATCH_SIZE:
+        return encode_rpc_error(None, -32600, f"Invalid Request: batch exceeds {RPC_MAX_BATCH_SIZE} calls")
+    
+    semaphore = asyncio.Semaphore(RPC_BATCH_CONCURRENCY)
+    
+    async def run(message: Any) -> Optional[bytes]:
+        async with semaphore:
+            return await dispatch(message, in_batch=True)
+    
+    responses = await asyncio.gather(*(run(message) for message in messages))
+    responses = [response for response in responses if response is not None]
+    if not responses:
+        return None  # Only notifications - nothing to return
+    return b"[" + b",".join(responses) + b"]"
+
+async def dispatch(message: Any, in_batch: bool = False) -> Optional[bytes]:
+    """Handle one JSON-RPC message and return the encoded response (None for notifications)."""
+    if not isinstance(message, dict):
+        return encode_rpc_error(None, -32600, "Invalid Request")
+    
+    notification = is_notification(message, in_batch)
+    request_id = message.get("id", None if in_batch else 1)
+    method = message.get("method")
+    handler = RPC_METHODS.get(method)
+    if log.debug_enabled:
+        log.debug("rpc.call", route="/mcp", method=method, id=request_id, payload=message.get("params"))
+    try:
+        if handler is None:
+            raise RPCError(-32601, f"Method not found: {method}")
+        params = message.get("params") or {}
+        if not isinstance(params, dict):
+            raise RPCError(-32602, "Invalid params: params must be an object")
+        result = await handler(params)
+    except RPCError as e:
+        if notification:
+            return None
+        return encode_rpc_error(request_id, e.code, e.message)
+    
+    if notification:
+        return None
+    return encode_rpc_result(request_id, result)
 
 # Add health endpoint to FastMCP app
 app = mcp.streamable_http_app()
 
+# Wrap the FastMCP lifespan so shared resources live as long as the app
+mcp_lifespan = app.router.lifespan_context
+
+@contextlib.asynccontextmanager
+async def server_lifespan(app):
+    """Create shared resources on startup and release them on shutdown."""
+    log.start()
+    get_http_client()
+    await asyncio.to_thread(geocode_cache.open)
+    await asyncio.to_thread(gazetteer.open)
+    index_build = asyncio.create_task(asyncio.to_thread(city_index.build, gazetteer))
+    await asyncio.to_thread(weather_cache.open)
+    await asyncio.to_thread(cache_snapshot.restore)
+    snapshots = asyncio.create_task(cache_snapshot.run()) if cache_snapshot.interval else None
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL))
+    warm_task = asyncio.create_task(cache_warmer.warm(await asyncio.to_thread(warm_city_list)))
+    refresh_ahead = asyncio.create_task(cache_warmer.run())
+    try:
+        async with mcp_lifespan(app):
+            yield
+    finally:
+        lag_monitor.cancel()
+        await asyncio.gather(index_build, return_exceptions=True)  # Its thread reads the gazetteer, unmapped below
+        warm_task.cancel()
+        refresh_ahead.cancel()
+        weather_cache.cancel_refreshes()
+        weather_batcher.cancel()
+        upstream_limiter.cancel()
+        await close_http_client()
+        if snapshots is not None:
+            snapshots.cancel()
+        try:
+            await cache_snapshot.save()
+        except OSError as e:
+            log.warning("cache.snapshot_failed", path=cache_snapshot.path, error=str(e))
+        await geocode_cache.flush_accesses()
+        geocode_cache.close()
+        gazetteer.close()
+        weather_cache.close()
+        log.stop()
+
+app.router.lifespan_context = server_lifespan
+
 @app.route("/health")
 async def health_endpoint(request):
     """HTTP health check endpoint."""
-    return JSONResponse({
+    return FastJSONResponse({
         "status": "healthy",
         "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
         "server": "weather-test-server",
-        "api_available": API_KEY != "demo"
+        "api_available": API_KEY != "demo",
+        "worker": {"pid": os.getpid(), "workers": MCP_WORKERS, "stateless_http": MCP_STATELESS_HTTP},
+        "http_pool": get_pool_stats(),
+        "geocode_cache": geocode_cache.stats(),
+        "gazetteer": gazetteer.stats(),
+        "city_index": city_index.stats(),
+        "weather_cache": weather_cache.stats(),
+        "cache_warmer": cache_warmer.stats(),
+        "cache_snapshot": cache_snapshot.stats(),
+        "upstream_requests": upstream_requests.stats(),
+        "weather_batcher": weather_batcher.stats(),
+        "upstream_limiter": upstream_limiter.stats(),
+        "circuit_breakers": {endpoint: breaker.stats() for endpoint, breaker in circuit_breakers.items()},
+        "hedging": upstream_hedging.stats()
     })
 
+@metrics.collector
+def collect_component_stats() -> list:
+    """Expose cache, connection pool, coalescing and batching stats as metrics."""
+    geocode = geocode_cache.stats()
+    places = gazetteer.stats()
+    weather = weather_cache.stats()
+    pool = get_pool_stats()
+    flights = upstream_requests.stats()
+    limiter = upstream_limiter.stats()
+    return [
+        ("process_cpu_seconds_total", "counter", "User and system CPU time used by this process", [
+            ({}, round(time.process_time(), 3)),
+        ]),
+        ("cache_requests_total", "counter", "Cache lookups by result", [
+            ({"cache": "geocode", "result": "hit"}, geocode["hits"]),
+            ({"cache": "geocode", "result": "miss"}, geocode["misses"]),
+            ({"cache": "gazetteer", "result": "hit"}, places["hits"]),
+            ({"cache": "gazetteer", "result": "miss"}, places["misses"]),
+            ({"cache": "weather", "result": "hit"}, weather["hits"]),
+            ({"cache": "weather", "result": "stale"}, weather["stale_hits"]),
+            ({"cache": "weather", "result": "miss"}, weather["misses"]),
+            ({"cache": "weather", "result": "nearby"}, weather["nearby_hits"]),
+        ]),
+        ("cache_nearby_distance_km", "gauge", "Distance from requested points to the cached data served for them", [
+            ({"stat": "mean"}, weather["nearby_mean_km"]),
+            ({"stat": "max"}, weather["nearby_max_km"]),
+        ]),
+        ("cache_hit_ratio", "gauge", "Share of cache lookups served from the cache", [
+            ({"cache": "geocode"}, geocode["hit_ratio"]),
+            ({"cache": "weather"}, weather["hit_ratio"]),
+        ]),
+        ("cache_entries", "gauge", "Entries held in each cache", [
+            ({"cache": "geocode"}, geocode["size"]),
+            ({"cache": "weather"}, weather["size"]),
+        ]),
+        ("http_pool_connections", "gauge", "Pooled upstream connections by state", [
+            ({"state": "in_use"}, pool["in_use"]),
+            ({"state": "idle"}, pool["idle"]),
+        ]),
+        ("http_pool_queued_requests", "gauge", "Upstream requests waiting for a pooled connection", [
+            ({}, pool["queued_requests"]),
+        ]),
+        ("http_pool_waits_total", "counter", "Upstream requests that had to wait for a pooled connection", [
+            ({}, pool["waits"]),
+        ]),
+        ("upstream_coalesced_requests_total", "counter", "Calls answered by an identical in-flight upstream request", [
+            ({}, flights["coalesced"]),
+        ]),
+        ("upstream_rate_limit_tokens", "gauge", "Upstream rate limit tokens available", [
+            ({}, limiter["tokens"]),
+        ]),
+        ("upstream_rate_limit_queue_depth", "gauge", "Upstream calls waiting for a rate limit token", [
+            ({"priority": name}, depth) for name, depth in limiter["queue_depth"].items()
+        ]),
+        ("upstream_rate_limit_rejected_total", "counter", "Upstream calls failed because no token would arrive before the deadline", [
+            ({"priority": name}, count) for name, count in limiter["rejected"].items()
+        ]),
+        ("upstream_throttled_total", "counter", "HTTP 429 responses from OpenWeatherMap", [
+            ({}, limiter["throttled"]),
+        ]),
+        ("upstream_circuit_state", "gauge", "Circuit breaker state per endpoint (0 closed, 1 half-open, 2 open)", [
+            ({"endpoint": endpoint}, CIRCUIT_STATES[breaker.state]) for endpoint, breaker in circuit_breakers.items()
+        ]),
+        ("upstream_circuit_opened_total", "counter", "Times each endpoint's circuit breaker opened", [
+            ({"endpoint": endpoint}, breaker.opened) for endpoint, breaker in circuit_breakers.items()
+        ]),
+        ("upstream_circuit_rejected_total", "counter", "Calls failed fast by an open circuit breaker", [
+            ({"endpoint": endpoint}, breaker.rejected) for endpoint, breaker in circuit_breakers.items()
+        ]),
+        ("upstream_hedged_requests_total", "counter", "Upstream calls that sent a hedge attempt", [
+            ({"endpoint": endpoint}, count) for endpoint, count in upstream_hedging.hedged.items()
+        ]),
+        ("upstream_hedge_wins_total", "counter", "Hedged calls by the attempt that answered", [
+            ({"endpoint": endpoint, "attempt": attempt}, count)
+            for (endpoint, attempt), count in upstream_hedging.wins.items()
+        ]),
+        ("upstream_hedge_delay_seconds", "gauge", "Current hedge delay (recent p95 latency) per endpoint", [
+            ({"endpoint": endpoint}, upstream_hedging.delay(endpoint)) for endpoint in upstream_hedging.p95
+        ] if upstream_hedging.enabled else []),
+        ("cache_refresh_ahead_total", "counter", "Hot weather cache entries refreshed before going stale", [
+            ({}, cache_warmer.refreshed),
+        ]),
+        ("cache_fallback_hits_total", "counter", "Expired weather cache entries served because upstream failed", [
+            ({}, weather["fallback_hits"]),
+        ]),
+        ("weather_batch_requests_total", "counter", "Current-weather upstream requests by lookups served", [
+            ({"size": str(size)}, count) for size, count in sorted(weather_batcher.batch_sizes.items())
+        ]),
+    ]
+
+@app.route("/metrics")
+async def metrics_endpoint(request):
+    """Prometheus metrics endpoint."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.route("/mcp", methods=["GET", "POST"])
 async def mcp_endpoint(request: Request):
     """MCP protocol endpoint - handles JSON-RPC requests."""
     if request.method == "GET":
-        # Handle GET request with query parameters
-        query_params = dict(request.query_params)
-        
-        # Return server capabilities
-        return JSONResponse({
-            "jsonrpc": "2.0",
-            "id": 1,
-            "result": {
-                "protocolVersion": "2025-06-18",
-                "capabilities": {
-                    "tools": {
-                        "listChanged": False
-                    }
-                },
-                "serverInfo": {
-                    "name": "weather-test-server",
-                    "version": "1.0.0",
-                    "description": "Enhanced MCP weather server with forecast functionality"
-                },
-                "tools": [
-                    {
-                        "name": "get_current_time",
-                        "description": "Get the current time in a human-readable format",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {},
-                            "required": []
-                        }
-                    },
-                    {
-                        "name": "echo_message",
-                        "description": "Echo back the provided message",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "message": {
-                                    "type": "string",
-                                    "description": "The message to echo back"
-                                }
-                            },
-                            "required": ["message"]
-                        }
-                    },
-                    {
-                        "name": "add_numbers",
-                        "description": "Add two numbers together",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "a": {
-                                    "type": "number",
-                                    "description": "First number"
-                                },
-                                "b": {
-                                    "type": "number",
-                                    "description": "Second number"
-                                }
-                            },
-                            "required": ["a", "b"]
-                        }
-                    },
-                    {
-                        "name": "get_weather",
-                        "description": "Get current weather information for a city",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "city": {
-                                    "type": "string",
-                                    "description": "Name of the city (e.g., 'London', 'New York', 'Tokyo')"
-                                }
-                            },
-                            "required": ["city"]
-                        }
-                    },
-                    {
-                        "name": "get_forecast",
-                        "description": "Get weather forecast for a city",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "city": {
-                                    "type": "string",
-                                    "description": "Name of the city"
-                                },
-                                "days": {
-                                    "type": "integer",
-                                    "description": "Number of days to forecast (1-5, default: 3)",
-                                    "minimum": 1,
-                                    "maximum": 5,
-                                    "default": 3
-                                }
-                            },
-                            "required": ["city"]
-                        }
-                    },
-                    {
-                        "name": "get_weather_alerts",
-                        "description": "Get weather alerts for a city (if available)",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "city": {
-                                    "type": "string",
-                                    "description": "Name of the city"
-                                }
-                            },
-                            "required": ["city"]
-                        }
-                    },
-                    {
-                        "name": "compare_cities_weather",
-                        "description": "Compare weather between two cities",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "city1": {
-                                    "type": "string",
-                                    "description": "First city name"
-                                },
-                                "city2": {
-                                    "type": "string",
-                                    "description": "Second city name"
-                                }
-                            },
-                            "required": ["city1", "city2"]
-                        }
-                    },
-                    {
-                        "name": "get_server_info",
-                        "description": "Get information about this MCP server",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {},
-                            "required": []
-                        }
-                    },
-                    {
-                        "name": "health_check",
-                        "description": "Health check endpoint for server monitoring",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {},
-                            "required": []
-                        }
-                    }
-                ]
-            }
-        })
+        # Return pre-serialized server capabilities, or 304 if the client has them
+        if etag_matches(request.headers.get("if-none-match"), CAPABILITIES_ETAG):
+            return Response(status_code=304, headers={"ETag": CAPABILITIES_ETAG})
+        return Response(
+            CAPABILITIES_BODY,
+            media_type="application/json",
+            headers={"ETag": CAPABILITIES_ETAG, "Cache-Control": "no-cache"},
+        )
     
     elif request.method == "POST":
-        # Handle POST request with JSON-RPC
+        mcp_in_flight.inc()
         try:
-            data = await request.json()
-            print(f"[DEBUG] Raw POST data: {data}")
-            method = data.get("method")
-            params = data.get("params", {})
-            request_id = data.get("id", 1)
-            
-            # Debug logging
-            print(f"[DEBUG] MCP method: {method}, params: {params}, id: {request_id}")
-            
-            if method == "initialize":
-                # Handle MCP initialization
-                client_protocol_version = params.get("protocolVersion", "2024-11-05")
-                return JSONResponse({
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "result": {
-                        "protocolVersion": client_protocol_version,  # Use client's version
-                        "capabilities": {
-                            "tools": {
-                                "listChanged": False
-                            }
-                        },
-                        "serverInfo": {
-                            "name": "weather-test-server",
-                            "version": "1.0.0",
-                            "description": "Enhanced MCP weather server with forecast functionality"
-                        }
-                    }
-                })
-            
-            elif method == "tools/call":
-                tool_name = params.get("name")
-                tool_args = params.get("arguments", {})
-                
-                # Map tool calls to functions
-                tool_functions = {
-                    "get_current_time": get_current_time,
-                    "echo_message": echo_message,
-                    "add_numbers": add_numbers,
-                    "get_weather": get_weather,
-                    "get_forecast": get_forecast,
-                    "get_weather_alerts": get_weather_alerts,
-                    "compare_cities_weather": compare_cities_weather,
-                    "get_server_info": get_server_info,
-                    "health_check": health_check
-                }
-                
-                if tool_name in tool_functions:
-                    try:
-                        result = await tool_functions[tool_name](**tool_args)
-                        return JSONResponse({
-                            "jsonrpc": "2.0",
-                            "id": request_id,
-                            "result": {
-                                "content": [
-                                    {
-                                        "type": "text",
-                                        "text": result
-                                    }
-                                ]
-                            }
-                        })
-                    except Exception as e:
-                        return JSONResponse({
-                            "jsonrpc": "2.0",
-                            "id": request_id,
-                            "error": {
-                                "code": -32603,
-                                "message": f"Tool execution error: {str(e)}"
-                            }
-                        })
-                else:
-                    return JSONResponse({
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "error": {
-                            "code": -32601,
-                            "message": f"Tool not found: {tool_name}"
-                        }
-                    })
-            
-            elif method == "notifications/initialized":
-                # Handle MCP initialization notification (notifications don't have responses)
-                # For notifications (no id), return empty response
-                if "id" not in data:
-                    # This is a notification - return empty response
-                    return JSONResponse({})
-                else:
-                    return JSONResponse({
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "result": {}
-                    })
-            
-            elif method == "tools/list":
-                # Return list of available tools
-                return JSONResponse({
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "result": {
-                        "tools": [
-                            {
-                                "name": "get_current_time",
-                                "description": "Get the current time in a human-readable format",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {},
-                                    "required": []
-                                }
-                            },
-                            {
-                                "name": "echo_message",
-                                "description": "Echo back the provided message",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "message": {
-                                            "type": "string",
-                                            "description": "The message to echo back"
-                                        }
-                                    },
-                                    "required": ["message"]
-                                }
-                            },
-                            {
-                                "name": "add_numbers",
-                                "description": "Add two numbers together",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "a": {
-                                            "type": "number",
-                                            "description": "First number"
-                                        },
-                                        "b": {
-                                            "type": "number",
-                                            "description": "Second number"
-                                        }
-                                    },
-                                    "required": ["a", "b"]
-                                }
-                            },
-                            {
-                                "name": "get_weather",
-                                "description": "Get current weather information for a city",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "city": {
-                                            "type": "string",
-                                            "description": "Name of the city (e.g., 'London', 'New York', 'Tokyo')"
-                                        }
-                                    },
-                                    "required": ["city"]
-                                }
-                            },
-                            {
-                                "name": "get_forecast",
-                                "description": "Get weather forecast for a city",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "city": {
-                                            "type": "string",
-                                            "description": "Name of the city"
-                                        },
-                                        "days": {
-                                            "type": "integer",
-                                            "description": "Number of days to forecast (1-5, default: 3)",
-                                            "minimum": 1,
-                                            "maximum": 5,
-                                            "default": 3
-                                        }
-                                    },
-                                    "required": ["city"]
-                                }
-                            },
-                            {
-                                "name": "get_weather_alerts",
-                                "description": "Get weather alerts for a city (if available)",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "city": {
-                                            "type": "string",
-                                            "description": "Name of the city"
-                                        }
-                                    },
-                                    "required": ["city"]
-                                }
-                            },
-                            {
-                                "name": "compare_cities_weather",
-                                "description": "Compare weather between two cities",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "city1": {
-                                            "type": "string",
-                                            "description": "First city name"
-                                        },
-                                        "city2": {
-                                            "type": "string",
-                                            "description": "Second city name"
-                                        }
-                                    },
-                                    "required": ["city1", "city2"]
-                                }
-                            },
-                            {
-                                "name": "get_server_info",
-                                "description": "Get information about this MCP server",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {},
-                                    "required": []
-                                }
-                            },
-                            {
-                                "name": "health_check",
-                                "description": "Health check endpoint for server monitoring",
-                                "inputSchema": {
-                                    "type": "object",
-                                    "properties": {},
-                                    "required": []
-                                }
-                            }
-                        ]
-                    }
-                })
-            
-            else:
-                print(f"[DEBUG] Unhandled method: {method}")
-                return JSONResponse({
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "error": {
-                        "code": -32601,
-                        "message": f"Method not found: {method}"
-                    }
-                })
-                
-        except Exception as e:
-            print(f"[DEBUG] Exception in POST handler: {str(e)}")
-            return JSONResponse({
-                "jsonrpc": "2.0",
-                "id": 1,
-                "error": {
-                    "code": -32700,
-                    "message": f"Parse error: {str(e)}"
-                }
-            })
+            return await handle_rpc_post(request)
+        finally:
+            mcp_in_flight.dec()
     
     else:
-        return JSONResponse({
+        return FastJSONResponse({
             "error": "Method not allowed"
         }, status_code=405)
 
+class ClientDisconnected(Exception):
+    """The client closed the connection before its response was ready."""
+
+def has_tool_call(data: Any) -> bool:
+    """Whether a JSON-RPC message or batch calls a tool (the only methods worth cancelling)."""
+    messages = data if isinstance(data, list) else [data]
+    return any(isinstance(message, dict) and message.get("method") == "tools/call" for message in messages)
+
+async def cancel_on_disconnect(request: Request, work) -> Any:
+    """Await work, cancelling it and raising ClientDisconnected if the client goes away first."""
+    async def wait_for_disconnect() -> None:
+        # The body has been read, so the next ASGI message is the disconnect
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+    
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        done, _ = await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task not in done:
+        task.cancel()
+        raise ClientDisconnected()
+    return task.result()
+
+async def handle_rpc_post(request: Request) -> Response:
+    """Handle a POST to /mcp carrying a JSON-RPC message or batch."""
+    try:
+        data = json_loads(await request.body())
+    except Exception as e:
+        log.warning("mcp.parse_error", route="/mcp", error=str(e))
+        return Response(encode_rpc_error(1, -32700, f"Parse error: {str(e)}"), media_type="application/json")
+    
+    log.debug("mcp.request", route="/mcp", payload=data)
+    timeout = parse_timeout(request.headers.get("x-request-timeout"))
+    request_deadline.set(time.monotonic() + timeout if timeout is not None else None)
+    work = dispatch_batch(data) if isinstance(data, list) else dispatch(data)
+    try:
+        body = await cancel_on_disconnect(request, work) if has_tool_call(data) else await work
+    except ClientDisconnected:
+        client_disconnects.inc()
+        log.info("mcp.client_disconnected", route="/mcp")
+        return Response(status_code=499)  # Nobody is listening; the status is for access logs
+    
+    if isinstance(data, list):
+        if body is None:
+            # A batch of only notifications gets no response body
+            return Response(status_code=202)
+        return Response(body, media_type="application/json")
+    
+    if body is None:
+        # Notifications have no result - return empty response
+        return FastJSONResponse({})
+    return Response(body, media_type="application/json")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run enhanced MCP weather server")
     parser.add_argument("--port", type=int, default=int(os.getenv("MCP_SERVER_PORT", 8124)), help="Port to listen on")
     parser.add_argument("--host", type=str, default=os.getenv("MCP_SERVER_HOST", "localhost"), help="Host to bind to")
     parser.add_argument("--api-key", type=str, help="OpenWeatherMap API key")
+    parser.add_argument("--workers", type=int, default=MCP_WORKERS, help="Worker processes serving the port")
     args = parser.parse_args()
     
     if args.api_key:
         API_KEY = args.api_key
+        os.environ["OPENWEATHER_API_KEY"] = args.api_key  # Workers re-import this module
     
     print(f"🌤️  Starting enhanced MCP weather server on {args.host}:{args.port}")
     print("📡 Available tools:")
@@ -697,10 +2946,25 @@ if __name__ == "__main__":
     print("   - get_weather: Get current weather for a city")
     print("   - get_forecast: Get weather forecast for a city")
     print("   - get_weather_alerts: Get weather alerts for a city")
+    print("   - compare_weather: Compare weather across several cities")
     print("   - compare_cities_weather: Compare weather between two cities")
     print("   - get_server_info: Get server information")
     print("   - health_check: Server health status")
     print(f"🔑 API Status: {'***' + API_KEY[-4:] if len(API_KEY) > 4 else 'demo mode'}")
     print(f"🏥 Health endpoint: http://{args.host}:{args.port}/health")
     
-    uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
+    if args.workers > 1:
+        # Each worker imports the app afresh, so settings travel through the environment
+        os.environ["MCP_WORKERS"] = str(args.workers)
+        os.environ["MCP_STATELESS_HTTP"] = "true"
+        os.environ.setdefault("WEATHER_CACHE_DB", "weather_cache.db")
+        print(f"👥 Workers: {args.workers} (stateless HTTP, shared caches in {os.environ['WEATHER_CACHE_DB']})")
+        uvicorn.run(
+            f"{os.path.splitext(os.path.basename(__file__))[0]}:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            app_dir=os.path.dirname(os.path.abspath(__file__)),
+        )
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
@@ -0,0 +1,384 @@
+"""Local stub of the OpenWeatherMap API for testing the weather MCP servers.
+
+Serves deterministic responses for the endpoints the servers use:
+/geo/1.0/direct, /data/2.5/weather, /data/2.5/forecast and /data/2.5/group.
+Point a server at it with:
+
+    python I14_stubOpenWeather.py --port 8125 --latency-ms 50
+    OPENWEATHER_API_BASE=http://localhost:8125/data/2.5 \\
+    GEO_API_BASE=http://localhost:8125/geo/1.0 \\
+    python I12_newMcpStreamable.py
+
+Request counts per endpoint and /group batch sizes are available at /stats.
+With --quota-per-minute, calls over the quota get HTTP 429 with Retry-After,
+and --error-rate answers that fraction of calls with HTTP 503.
+
+Instead of synthetic data, the stub can serve real responses from a
+cassette file. Record one by proxying a server's calls to OpenWeatherMap,
+then replay it offline with whatever latency and errors the run needs:
+
+    python I14_stubOpenWeather.py --record weather.cassette.json
+    python I14_stubOpenWeather.py --replay weather.cassette.json \\
+        --latency-ms 80 --jitter-ms 40 --error-rate 0.02 --seed 1
+
+Requests are matched on path and query, ignoring the API key. In replay
+mode a request that was never recorded gets HTTP 404. /group requests
+are the exception: which IDs a server batches together depends on
+timing, so in replay mode they are answered city by city from every
+recorded /weather and /group response.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Known cities; any other name gets deterministic coordinates derived from its hash
+CITIES = {
+    "london": ("London", "GB", 51.5073, -0.1276),
+    "paris": ("Paris", "FR", 48.8589, 2.3200),
+    "new york": ("New York", "US", 40.7127, -74.0060),
+    "tokyo": ("Tokyo", "JP", 35.6828, 139.7594),
+    "sydney": ("Sydney", "AU", -33.8698, 151.2083),
+    "mumbai": ("Mumbai", "IN", 19.0550, 72.8692),
+    "kochi": ("Kochi", "IN", 9.9312, 76.2673),
+    "berlin": ("Berlin", "DE", 52.5170, 13.3889),
+    "cairo": ("Cairo", "EG", 30.0444, 31.2357),
+    "moscow": ("Moscow", "RU", 55.7504, 37.6175),
+}
+CONDITIONS = [
+    (800, "Clear", "clear sky"),
+    (802, "Clouds", "scattered clouds"),
+    (500, "Rain", "light rain"),
+    (211, "Thunderstorm", "thunderstorm"),
+    (600, "Snow", "light snow"),
+]
+UNKNOWN_PREFIX = "nowhere"  # Names starting with this are not found
+
+LATENCY = 0.0
+JITTER = 0.0  # Extra latency drawn uniformly from [0, JITTER]
+ERROR_RATE = 0.0  # Fraction of calls answered with HTTP 503
+QUOTA = 0  # Calls per minute before answering 429, 0 for unlimited
+OPENWEATHER_HOST = "https://api.openweathermap.org"
+quota_window = {"start": 0.0, "calls": 0}
+stats = {
+    "requests": {}, "group_sizes": {}, "throttled": 0, "injected_errors": 0,
+    "cassette": {"replayed": 0, "recorded": 0, "misses": 0},
+}
+rng = random.Random()
+
+def count(endpoint: str) -> None:
+    """Count one request to an endpoint."""
+    stats["requests"][endpoint] = stats["requests"].get(endpoint, 0) + 1
+
+def seed(*parts) -> int:
+    """Stable integer derived from the given values."""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def city_id(lat: float, lon: float) -> int:
+    """Encode rounded coordinates as a city ID so /group can decode them."""
+    return int(round((lat + 90) * 100)) * 100000 + int(round((lon + 180) * 100))
+
+def id_location(city_id_value: int) -> tuple:
+    """Decode a city ID back into coordinates."""
+    return (city_id_value // 100000) / 100 - 90, (city_id_value % 100000) / 100 - 180
+
+def convert(celsius: float, units: str) -> float:
+    """Convert a Celsius temperature to the requested units."""
+    if units == "metric":
+        return round(celsius, 2)
+    if units == "imperial":
+        return round(celsius * 9 / 5 + 32, 2)
+    return round(celsius + 273.15, 2)
+
+def observation(lat: float, lon: float, units: str, slot: int = 0) -> dict:
+    """Deterministic weather observation for a location and time slot."""
+    value = seed(round(lat, 2), round(lon, 2), slot)
+    code, main, description = CONDITIONS[value % len(CONDITIONS)]
+    celsius = 30 - abs(lat) / 2 + (value % 100) / 10 - 5
+    wind = (value >> 8) % 200 / 10
+    if units == "imperial":
+        wind = round(wind * 2.237, 2)
+    return {
+        "weather": [{"id": code, "main": main, "description": description, "icon": "01d"}],
+        "main": {
+            "temp": convert(celsius, units),
+            "feels_like": convert(celsius - 1.5, units),
+            "temp_min": convert(celsius - 2, units),
+            "temp_max": convert(celsius + 2, units),
+            "pressure": 1000 + (value >> 16) % 30,
+            "humidity": 20 + (value >> 24) % 80,
+        },
+        "wind": {"speed": wind, "deg": (value >> 32) % 360},
+        "visibility": 10000,
+    }
+
+def current(lat: float, lon: float, units: str) -> dict:
+    """Current weather response for a location, shaped like /data/2.5/weather."""
+    data = observation(lat, lon, units)
+    data.update({
+        "coord": {"lat": round(lat, 4), "lon": round(lon, 4)},
+        "dt": int(time.time()),
+        "timezone": 0,
+        "id": city_id(lat, lon),
+        "name": f"Stub {round(lat, 2)},{round(lon, 2)}",
+        "cod": 200,
+    })
+    return data
+
+def over_quota() -> int:
+    """Count a call against the per-minute quota; return seconds to wait if it is over."""
+    if not QUOTA:
+        return 0
+    now = time.monotonic()
+    if now - quota_window["start"] >= 60:
+        quota_window["start"], quota_window["calls"] = now, 0
+    quota_window["calls"] += 1
+    if quota_window["calls"] <= QUOTA:
+        return 0
+    return max(int(quota_window["start"] + 60 - now + 0.999), 1)
+
+class Cassette:
+    """Recorded upstream responses, saved as one JSON file.
+
+    With an upstream URL, requests missing from the file are forwarded
+    there and their responses are added to it (record mode). Without one,
+    only recorded responses are served (replay mode).
+    """
+
+    def __init__(self, path: str, upstream: str = ""):
+        self.path = path
+        self.upstream = upstream.rstrip("/")
+        self.entries = {}  # key -> {"status": int, "body": Any}
+        self.cities = {}  # (city ID, units) -> current weather from any recorded response
+        self.client: Optional[httpx.AsyncClient] = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)["interactions"]
+        for key, entry in self.entries.items():
+            self.index_cities(key, entry["body"])
+
+    def index_cities(self, key: str, body) -> None:
+        """Remember each city in a recorded /weather or /group response by ID and units."""
+        path, _, query = key.partition("?")
+        units = dict(parse_qsl(query)).get("units", "standard")
+        if path.endswith("/weather"):
+            items = [body]
+        elif path.endswith("/group"):
+            items = body.get("list", [])
+        else:
+            return
+        for item in items:
+            if isinstance(item, dict) and item.get("id"):
+                self.cities[(item["id"], units)] = item
+
+    def make_key(self, request: Request) -> str:
+        """Path and sorted query of a request, without the API key."""
+        query = sorted((k, v) for k, v in request.query_params.multi_items() if k != "appid")
+        return f"{request.url.path}?{urlencode(query)}"
+
+    async def respond(self, request: Request) -> Response:
+        """Serve the recorded response for a request, recording it first if needed."""
+        key = self.make_key(request)
+        entry = self.entries.get(key)
+        if entry is None and self.upstream:
+            return await self.record(request, key)
+        if entry is None:
+            stats["cassette"]["misses"] += 1
+            return JSONResponse({"cod": "404", "message": f"Not in cassette: {key}"}, status_code=404)
+        stats["cassette"]["replayed"] += 1
+        return JSONResponse(entry["body"], status_code=entry["status"])
+
+    async def respond_group(self, request: Request) -> Response:
+        """Serve a /group request from recorded cities, whatever IDs were batched when recording."""
+        if self.upstream:
+            return await self.respond(request)
+        units = request.query_params.get("units", "standard")
+        ids = [int(value) for value in request.query_params.get("id", "").split(",") if value]
+        missing = [city_id for city_id in ids if (city_id, units) not in self.cities]
+        if missing:
+            stats["cassette"]["misses"] += 1
+            return JSONResponse({"cod": "404", "message": f"Cities not in cassette: {missing}"}, status_code=404)
+        stats["cassette"]["replayed"] += 1
+        items = [self.cities[(city_id, units)] for city_id in ids]
+        return JSONResponse({"cnt": len(items), "list": items})
+
+    async def record(self, request: Request, key: str) -> Response:
+        """Forward a request upstream and keep its response unless it is an error."""
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=10.0)
+        upstream = await self.client.get(f"{self.upstream}{request.url.path}", params=request.query_params.multi_items())
+        if upstream.status_code < 400:
+            self.entries[key] = {"status": upstream.status_code, "body": upstream.json()}
+            self.index_cities(key, self.entries[key]["body"])
+            stats["cassette"]["recorded"] += 1
+            self.save()
+        return Response(upstream.content, status_code=upstream.status_code, media_type="application/json")
+
+    def save(self) -> None:
+        """Write the cassette file, replacing it atomically."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"interactions": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+cassette: Optional[Cassette] = None
+
+async def check_request(request: Request):
+    """Apply injected latency and errors, the call quota and reject bad API keys."""
+    if LATENCY or JITTER:
+        await asyncio.sleep(LATENCY + rng.uniform(0, JITTER))
+    if request.query_params.get("appid") == "invalid":
+        return JSONResponse({"cod": 401, "message": "Invalid API key."}, status_code=401)
+    if ERROR_RATE and rng.random() < ERROR_RATE:
+        stats["injected_errors"] += 1
+        return JSONResponse({"cod": 503, "message": "Injected upstream error"}, status_code=503)
+    retry_after = over_quota()
+    if retry_after:
+        stats["throttled"] += 1
+        return JSONResponse(
+            {"cod": 429, "message": "Your account is temporary blocked due to exceeding of requests limitation."},
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+        )
+    return None
+
+async def geocode(request: Request):
+    """Geocoding endpoint (/geo/1.0/direct)."""
+    count("geo")
+    error = await check_request(request)
+    if error:
+        return error
+    if cassette:
+        return await cassette.respond(request)
+    name = request.query_params.get("q", "")
+    key = " ".join(name.split()).casefold()
+    if key.startswith(UNKNOWN_PREFIX):
+        return JSONResponse([])
+    if key in CITIES:
+        city, country, lat, lon = CITIES[key]
+    else:
+        value = seed(key)
+        city, country = name, "XX"
+        lat = round((value % 14000) / 100 - 70, 4)
+        lon = round(((value >> 16) % 36000) / 100 - 180, 4)
+    return JSONResponse([{"name": city, "lat": lat, "lon": lon, "country": country}])
+
+async def weather(request: Request):
+    """Current weather endpoint (/data/2.5/weather)."""
+    count("weather")
+    error = await check_request(request)
+    if error:
+        return error
+    if cassette:
+        return await cassette.respond(request)
+    lat = float(request.query_params["lat"])
+    lon = float(request.query_params["lon"])
+    return JSONResponse(current(lat, lon, request.query_params.get("units", "standard")))
+
+async def group(request: Request):
+    """Several cities by ID (/data/2.5/group)."""
+    count("group")
+    error = await check_request(request)
+    if error:
+        return error
+    if cassette:
+        return await cassette.respond_group(request)
+    ids = [int(value) for value in request.query_params.get("id", "").split(",") if value]
+    if len(ids) > 20:
+        return JSONResponse({"cod": "400", "message": "Too many city IDs"}, status_code=400)
+    stats["group_sizes"][len(ids)] = stats["group_sizes"].get(len(ids), 0) + 1
+    units = request.query_params.get("units", "standard")
+    items = []
+    for value in ids:
+        lat, lon = id_location(value)
+        items.append(current(lat, lon, units))
+    return JSONResponse({"cnt": len(items), "list": items})
+
+async def forecast(request: Request):
+    """5 day / 3 hour forecast endpoint (/data/2.5/forecast)."""
+    count("forecast")
+    error = await check_request(request)
+    if error:
+        return error
+    if cassette:
+        return await cassette.respond(request)
+    lat = float(request.query_params["lat"])
+    lon = float(request.query_params["lon"])
+    units = request.query_params.get("units", "standard")
+    start = int(time.time()) // 10800 * 10800 + 10800
+    items = []
+    for slot in range(40):  # 5 days of 3-hour slots
+        dt = start + slot * 10800
+        item = observation(lat, lon, units, slot)
+        item["dt"] = dt
+        item["dt_txt"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt))
+        items.append(item)
+    return JSONResponse({
+        "cod": "200",
+        "cnt": len(items),
+        "list": items,
+        "city": {"id": city_id(lat, lon), "coord": {"lat": lat, "lon": lon}, "timezone": 0},
+    })
+
+async def stats_endpoint(request: Request):
+    """Request counts and /group batch sizes."""
+    return JSONResponse(stats)
+
+app = Starlette(routes=[
+    Route("/geo/1.0/direct", geocode),
+    Route("/data/2.5/weather", weather),
+    Route("/data/2.5/group", group),
+    Route("/data/2.5/forecast", forecast),
+    Route("/stats", stats_endpoint),
+])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenWeatherMap stub")
+    parser.add_argument("--port", type=int, default=8125, help="Port to listen on")
+    parser.add_argument("--host", type=str, default="localhost", help="Host to bind to")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency of up to this much")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of calls answered with 503")
+    parser.add_argument("--quota-per-minute", type=int, default=0, help="Answer 429 above this many calls per minute")
+    parser.add_argument("--seed", type=int, help="Seed for jitter and injected errors, for repeatable runs")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", type=str, metavar="CASSETTE", help="Proxy to OpenWeatherMap and save responses here")
+    mode.add_argument("--replay", type=str, metavar="CASSETTE", help="Serve only the responses saved here")
+    parser.add_argument("--upstream", type=str, default=OPENWEATHER_HOST, help="Host to proxy to when recording")
+    args = parser.parse_args()
+
+    LATENCY = args.latency_ms / 1000
+    JITTER = args.jitter_ms / 1000
+    ERROR_RATE = args.error_rate
+    QUOTA = args.quota_per_minute
+    if args.seed is not None:
+        rng.seed(args.seed)
+    if args.record:
+        cassette = Cassette(args.record, args.upstream)
+    elif args.replay:
+        if not os.path.exists(args.replay):
+            parser.error(f"cassette not found: {args.replay}")
+        cassette = Cassette(args.replay)
+
+    print(f"🧪 Starting OpenWeatherMap stub on {args.host}:{args.port}")
+    print(f"   OPENWEATHER_API_BASE=http://{args.host}:{args.port}/data/2.5")
+    print(f"   GEO_API_BASE=http://{args.host}:{args.port}/geo/1.0")
+    if args.record:
+        print(f"📼 Recording {args.upstream} responses to {args.record}")
+    elif args.replay:
+        print(f"📼 Replaying {len(cassette.entries)} responses from {args.replay}")
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,320 @@
+"""Microbenchmark of JSON-RPC dispatch overhead in the weather MCP server.
+
+Compares the original if/elif chain in mcp_endpoint (which rebuilt the
+tool_functions map and response dicts on every request) against the
+table-driven dispatcher. The original is reproduced from the code as it
+was, including the inline tool schema literal and JSONResponse's
+encoding; only its per-request [DEBUG] prints are left out. Only dispatch
+and response encoding are timed; HTTP handling is not included and the
+tools called do no I/O.
+
+    python I15_benchDispatch.py --iterations 50000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("GEOCODE_CACHE_DB", "")  # Keep the benchmark off disk
+
+import I12_newMcpStreamable as server
+
+REQUESTS = {
+    "tools/call add_numbers": {
+        "jsonrpc": "2.0", "id": 7, "method": "tools/call",
+        "params": {"name": "add_numbers", "arguments": {"a": 2, "b": 3}},
+    },
+    "tools/call echo_message": {
+        "jsonrpc": "2.0", "id": 8, "method": "tools/call",
+        "params": {"name": "echo_message", "arguments": {"message": "hello"}},
+    },
+    "tools/list": {"jsonrpc": "2.0", "id": 9, "method": "tools/list"},
+    "initialize": {
+        "jsonrpc": "2.0", "id": 10, "method": "initialize",
+        "params": {"protocolVersion": "2025-06-18"},
+    },
+}
+
+def render(content: dict) -> bytes:
+    """Encode a response the way the original JSONResponse did."""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+async def legacy_dispatch(data: dict) -> bytes:
+    """The original POST branch of mcp_endpoint, copied verbatim but for its [DEBUG] prints."""
+    method = data.get("method")
+    params = data.get("params", {})
+    request_id = data.get("id", 1)
+
+    if method == "initialize":
+        # Handle MCP initialization
+        client_protocol_version = params.get("protocolVersion", "2024-11-05")
+        return render({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "result": {
+                "protocolVersion": client_protocol_version,  # Use client's version
+                "capabilities": {
+                    "tools": {
+                        "listChanged": False
+                    }
+                },
+                "serverInfo": {
+                    "name": "weather-test-server",
+                    "version": "1.0.0",
+                    "description": "Enhanced MCP weather server with forecast functionality"
+                }
+            }
+        })
+
+    elif method == "tools/call":
+        tool_name = params.get("name")
+        tool_args = params.get("arguments", {})
+
+        # Map tool calls to functions
+        tool_functions = {
+            "get_current_time": server.get_current_time,
+            "echo_message": server.echo_message,
+            "add_numbers": server.add_numbers,
+            "get_weather": server.get_weather,
+            "get_forecast": server.get_forecast,
+            "get_weather_alerts": server.get_weather_alerts,
+            "compare_cities_weather": server.compare_cities_weather,
+            "get_server_info": server.get_server_info,
+            "health_check": server.health_check
+        }
+
+        if tool_name in tool_functions:
+            try:
+                result = await tool_functions[tool_name](**tool_args)
+                return render({
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "result": {
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": result
+                            }
+                        ]
+                    }
+                })
+            except Exception as e:
+                return render({
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "error": {
+                        "code": -32603,
+                        "message": f"Tool execution error: {str(e)}"
+                    }
+                })
+        else:
+            return render({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {
+                    "code": -32601,
+                    "message": f"Tool not found: {tool_name}"
+                }
+            })
+
+    elif method == "notifications/initialized":
+        # Handle MCP initialization notification (notifications don't have responses)
+        # For notifications (no id), return empty response
+        if "id" not in data:
+            # This is a notification - return empty response
+            return render({})
+        else:
+            return render({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "result": {}
+            })
+
+    elif method == "tools/list":
+        # Return list of available tools
+        return render({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "result": {
+                "tools": [
+                    {
+                        "name": "get_current_time",
+                        "description": "Get the current time in a human-readable format",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {},
+                            "required": []
+                        }
+                    },
+                    {
+                        "name": "echo_message",
+                        "description": "Echo back the provided message",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "message": {
+                                    "type": "string",
+                                    "description": "The message to echo back"
+                                }
+                            },
+                            "required": ["message"]
+                        }
+                    },
+                    {
+                        "name": "add_numbers",
+                        "description": "Add two numbers together",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "a": {
+                                    "type": "number",
+                                    "description": "First number"
+                                },
+                                "b": {
+                                    "type": "number",
+                                    "description": "Second number"
+                                }
+                            },
+                            "required": ["a", "b"]
+                        }
+                    },
+                    {
+                        "name": "get_weather",
+                        "description": "Get current weather information for a city",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "city": {
+                                    "type": "string",
+                                    "description": "Name of the city (e.g., 'London', 'New York', 'Tokyo')"
+                                }
+                            },
+                            "required": ["city"]
+                        }
+                    },
+                    {
+                        "name": "get_forecast",
+                        "description": "Get weather forecast for a city",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "city": {
+                                    "type": "string",
+                                    "description": "Name of the city"
+                                },
+                                "days": {
+                                    "type": "integer",
+                                    "description": "Number of days to forecast (1-5, default: 3)",
+                                    "minimum": 1,
+                                    "maximum": 5,
+                                    "default": 3
+                                }
+                            },
+                            "required": ["city"]
+                        }
+                    },
+                    {
+                        "name": "get_weather_alerts",
+                        "description": "Get weather alerts for a city (if available)",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "city": {
+                                    "type": "string",
+                                    "description": "Name of the city"
+                                }
+                            },
+                            "required": ["city"]
+                        }
+                    },
+                    {
+                        "name": "compare_cities_weather",
+                        "description": "Compare weather between two cities",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "city1": {
+                                    "type": "string",
+                                    "description": "First city name"
+                                },
+                                "city2": {
+                                    "type": "string",
+                                    "description": "Second city name"
+                                }
+                            },
+                            "required": ["city1", "city2"]
+                        }
+                    },
+                    {
+                        "name": "get_server_info",
+                        "description": "Get information about this MCP server",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {},
+                            "required": []
+                        }
+                    },
+                    {
+                        "name": "health_check",
+                        "description": "Health check endpoint for server monitoring",
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {},
+                            "required": []
+                        }
+                    }
+                ]
+            }
+        })
+
+    else:
+        return render({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {
+                "code": -32601,
+                "message": f"Method not found: {method}"
+            }
+        })
+
+async def measure(dispatcher, message: dict, iterations: int) -> list:
+    """Time each call of dispatcher(message) in microseconds."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await dispatcher(message)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+def summarize(samples: list) -> dict:
+    """Mean, median and p99 of a list of samples."""
+    ordered = sorted(samples)
+    return {
+        "mean_us": round(statistics.fmean(ordered), 2),
+        "p50_us": round(ordered[len(ordered) // 2], 2),
+        "p99_us": round(ordered[int(len(ordered) * 0.99) - 1], 2),
+    }
+
+async def main(iterations: int) -> None:
+    print(f"Dispatch overhead per request ({iterations} iterations)")
+    print(f"{'request':<26}{'before mean':>13}{'after mean':>12}{'before p99':>12}{'after p99':>11}{'speedup':>9}")
+    for name, message in REQUESTS.items():
+        # Warm up both paths before timing
+        await measure(legacy_dispatch, message, 1000)
+        await measure(server.dispatch, message, 1000)
+        before = summarize(await measure(legacy_dispatch, message, iterations))
+        after = summarize(await measure(server.dispatch, message, iterations))
+        speedup = before["mean_us"] / after["mean_us"] if after["mean_us"] else float("inf")
+        print(
+            f"{name:<26}{before['mean_us']:>11.2f}us{after['mean_us']:>10.2f}us"
+            f"{before['p99_us']:>10.2f}us{after['p99_us']:>9.2f}us{speedup:>8.1f}x"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON-RPC dispatch overhead")
+    parser.add_argument("--iterations", type=int, default=20000, help="Timed calls per request type")
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations))
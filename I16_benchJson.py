@@ -0,0 +1,151 @@
+"""Benchmark the fast JSON layer of the weather MCP server.
+
+Part 1 times encode/decode of the server's largest payloads (an upstream
+forecast response, the tools/list result and the /health document) with
+stdlib json and with the server's json_dumps/json_loads.
+
+Part 2 drives the server app in-process with concurrent /mcp and /health
+requests and reports p50/p95/p99 latency with each encoder. Upstream calls
+go to the in-process OpenWeatherMap stub and the forecast cache is
+disabled, so every get_forecast call decodes a full 40-slot response.
+
+    python I16_benchJson.py --requests 2000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("GEOCODE_CACHE_DB", "")
+os.environ.setdefault("FORECAST_CACHE_TTL", "0")
+os.environ.setdefault("WEATHER_CACHE_MAX_STALE", "0")
+os.environ.setdefault("UPSTREAM_RATE_LIMIT", "0")  # The stub has no quota
+os.environ.setdefault("OPENWEATHER_API_BASE", "http://stub/data/2.5")
+os.environ.setdefault("GEO_API_BASE", "http://stub/geo/1.0")
+
+import httpx
+import I12_newMcpStreamable as server
+import I14_stubOpenWeather as stub
+
+def stdlib_dumps(value, indent: bool = False) -> bytes:
+    """What Starlette's JSONResponse did before the fast path."""
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+ENCODERS = {
+    "stdlib": (stdlib_dumps, json.loads),
+    "fast": (server.json_dumps, server.json_loads),
+}
+
+def forecast_payload() -> dict:
+    """A full 5 day / 3 hour forecast response, as returned upstream."""
+    items = []
+    for slot in range(40):
+        item = stub.observation(51.5073, -0.1276, "metric", slot)
+        item["dt"] = 1760000000 + slot * 10800
+        item["dt_txt"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(item["dt"]))
+        items.append(item)
+    return {"cod": "200", "cnt": 40, "list": items, "city": {"id": 2643743, "timezone": 0}}
+
+def time_call(func, value, iterations: int) -> float:
+    """Mean microseconds per call."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(value)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def bench_codecs(iterations: int) -> None:
+    payloads = {
+        "forecast (upstream)": forecast_payload(),
+        "tools/list": {"jsonrpc": "2.0", "id": 1, "result": {"tools": server.TOOL_SCHEMAS}},
+        "health": {
+            "status": "healthy",
+            "http_pool": server.get_pool_stats(),
+            "geocode_cache": server.geocode_cache.stats(),
+            "weather_cache": server.weather_cache.stats(),
+        },
+    }
+    print(f"Encode/decode time per payload ({iterations} iterations)")
+    print(f"{'payload':<22}{'bytes':>8}{'stdlib enc':>13}{'fast enc':>11}{'stdlib dec':>13}{'fast dec':>11}")
+    for name, payload in payloads.items():
+        encoded = stdlib_dumps(payload)
+        results = []
+        for dumps, loads in ENCODERS.values():
+            results.append((time_call(dumps, payload, iterations), time_call(loads, encoded, iterations)))
+        (std_enc, std_dec), (fast_enc, fast_dec) = results
+        print(
+            f"{name:<22}{len(encoded):>8}{std_enc:>11.1f}us{fast_enc:>9.1f}us"
+            f"{std_dec:>11.1f}us{fast_dec:>9.1f}us"
+        )
+
+REQUESTS = [
+    ("POST", "/mcp", {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}),
+    ("POST", "/mcp", {"jsonrpc": "2.0", "id": 2, "method": "tools/call",
+                      "params": {"name": "get_forecast", "arguments": {"city": "London", "days": 5}}}),
+    ("POST", "/mcp", {"jsonrpc": "2.0", "id": 3, "method": "tools/call",
+                      "params": {"name": "get_weather", "arguments": {"city": "Paris"}}}),
+    ("GET", "/health", None),
+]
+
+async def bench_load(total: int, concurrency: int) -> dict:
+    """Run the request mix and return latency percentiles in milliseconds."""
+    latencies = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(REQUESTS[i % len(REQUESTS)])
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://server") as client:
+        async def worker() -> None:
+            nonlocal errors
+            while not queue.empty():
+                method, path, body = queue.get_nowait()
+                start = time.perf_counter()
+                if method == "GET":
+                    response = await client.get(path)
+                else:
+                    response = await client.post(path, content=json.dumps(body))
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "rps": round(total / elapsed),
+        "p50_ms": round(ordered[int(len(ordered) * 0.50)], 2),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95)], 2),
+        "p99_ms": round(ordered[int(len(ordered) * 0.99)], 2),
+        "mean_ms": round(statistics.fmean(ordered), 2),
+        "errors": errors,
+    }
+
+async def main(args) -> None:
+    bench_codecs(args.iterations)
+
+    # Serve upstream calls from the stub app in-process
+    server.http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub.app))
+    print(f"\nLatency under load ({args.requests} requests, concurrency {args.concurrency})")
+    print(f"{'encoder':<10}{'rps':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>8}")
+    for name, (dumps, loads) in ENCODERS.items():
+        server.json_dumps, server.json_loads = dumps, loads
+        await bench_load(min(args.requests, 200), args.concurrency)  # Warm up
+        result = await bench_load(args.requests, args.concurrency)
+        print(
+            f"{name:<10}{result['rps']:>8}{result['p50_ms']:>8.2f}ms{result['p95_ms']:>8.2f}ms"
+            f"{result['p99_ms']:>8.2f}ms{result['errors']:>8}"
+        )
+    await server.close_http_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON encode/decode in the weather MCP server")
+    parser.add_argument("--iterations", type=int, default=2000, help="Encode/decode calls per payload")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per load run")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent clients per load run")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,320 @@
+"""Load generator for the /mcp endpoint of the weather MCP server.
+
+Each simulated client runs a realistic session: initialize, the
+initialized notification, tools/list, then a weighted mix of tools/call
+requests, and starts a new session after --session-calls calls. Clients
+either send back to back (--concurrency) or together pace requests to a
+target rate (--rps). In rate mode latency is measured from when a request
+was due, so a slow server is not hidden by clients that fell behind.
+
+The report gives throughput, p50/p95/p99 latency per request type, errors
+(HTTP, JSON-RPC and tool errors) and the server's CPU use, read from
+process_cpu_seconds_total on /metrics. --spawn starts the OpenWeatherMap
+stub and the server for the run, so no network access or API key is
+needed:
+
+    python I17_benchLoad.py --spawn --concurrency 50 --duration 30 --output run.json
+    python I17_benchLoad.py --spawn --rps 500 --duration 30 --compare run.json
+
+With --compare the run is checked against a saved result and the script
+exits with status 1 if p95 latency or throughput regressed by more than
+--max-regression percent.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+
+CITIES = ["London", "Paris", "New York", "Tokyo", "Sydney", "Mumbai", "Kochi", "Berlin", "Cairo", "Moscow"]
+
+# (weight, tool name, arguments factory)
+TOOL_MIX = [
+    (40, "get_weather", lambda rng: {"city": rng.choice(CITIES)}),
+    (25, "get_forecast", lambda rng: {"city": rng.choice(CITIES), "days": rng.randint(1, 5)}),
+    (10, "get_weather_alerts", lambda rng: {"city": rng.choice(CITIES)}),
+    (10, "compare_weather", lambda rng: {"cities": rng.sample(CITIES, 3)}),
+    (10, "add_numbers", lambda rng: {"a": rng.randint(0, 100), "b": rng.randint(0, 100)}),
+    (5, "get_server_info", lambda rng: {}),
+]
+
+def percentile(ordered: list, fraction: float) -> float:
+    """Value at the given fraction of a sorted list."""
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def summarize(latencies: list) -> dict:
+    """Latency percentiles in milliseconds."""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50), 2),
+        "p95_ms": round(percentile(ordered, 0.95), 2),
+        "p99_ms": round(percentile(ordered, 0.99), 2),
+        "mean_ms": round(statistics.fmean(ordered), 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+class LoadRun:
+    """Shared state of one load run: pacing, latencies and errors."""
+
+    def __init__(self, client: httpx.AsyncClient, rps: float, session_calls: int, seed: int):
+        self.client = client
+        self.rps = rps
+        self.session_calls = session_calls
+        self.seed = seed
+        self.started = 0.0
+        self.deadline = 0.0
+        self.scheduled = 0  # Requests handed a send slot so far (rate mode)
+        self.recording = False
+        self.latencies: dict = {}  # request type -> [ms]
+        self.errors: dict = {}  # kind -> count
+        self.sent = 0
+
+    def next_slot(self) -> float:
+        """Time the next request is due in rate mode."""
+        due = self.started + self.scheduled / self.rps
+        self.scheduled += 1
+        return due
+
+    def error(self, kind: str) -> None:
+        if self.recording:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    async def send(self, label: str, message: dict) -> Optional[dict]:
+        """Post one JSON-RPC message, timing it and counting any error."""
+        start = time.perf_counter()
+        if self.rps:
+            start = self.next_slot()
+            delay = start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if start >= self.deadline:
+            return None
+        try:
+            response = await self.client.post("/mcp", content=json.dumps(message))
+        except httpx.HTTPError as e:
+            self.error(type(e).__name__)
+            return None
+        elapsed = (time.perf_counter() - start) * 1000
+        if not self.recording:
+            return None
+        self.sent += 1
+        self.latencies.setdefault(label, []).append(elapsed)
+        if response.status_code >= 400:
+            self.error(f"http_{response.status_code}")
+            return None
+        if response.status_code == 202 or not response.content:
+            return {}
+        body = response.json()
+        if "error" in body:
+            self.error("rpc_error")
+        elif body.get("result", {}).get("isError"):
+            self.error("tool_error")
+        return body
+
+    async def client_loop(self, client_id: int) -> None:
+        """Run sessions back to back until the deadline."""
+        rng = random.Random(self.seed * 100003 + client_id)
+        weights = [weight for weight, _, _ in TOOL_MIX]
+        request_id = 0
+        while time.perf_counter() < self.deadline:
+            request_id += 1
+            await self.send("initialize", {
+                "jsonrpc": "2.0", "id": request_id, "method": "initialize",
+                "params": {"protocolVersion": "2024-11-05", "capabilities": {},
+                           "clientInfo": {"name": "I17_benchLoad", "version": "1.0"}},
+            })
+            await self.send("notifications/initialized", {"jsonrpc": "2.0", "method": "notifications/initialized"})
+            request_id += 1
+            await self.send("tools/list", {"jsonrpc": "2.0", "id": request_id, "method": "tools/list"})
+            for _ in range(self.session_calls):
+                if time.perf_counter() >= self.deadline:
+                    break
+                _, name, arguments = rng.choices(TOOL_MIX, weights)[0]
+                request_id += 1
+                await self.send(f"tools/call {name}", {
+                    "jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+                    "params": {"name": name, "arguments": arguments(rng)},
+                })
+
+    async def run(self, clients: int, duration: float, recording: bool) -> float:
+        """Run all clients for duration seconds and return the elapsed time."""
+        self.recording = recording
+        self.scheduled = 0
+        self.started = time.perf_counter()
+        self.deadline = self.started + duration
+        await asyncio.gather(*(self.client_loop(i) for i in range(clients)))
+        return time.perf_counter() - self.started
+
+async def server_cpu_seconds(client: httpx.AsyncClient) -> Optional[float]:
+    """CPU seconds used so far by the server process that answers /metrics."""
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    for line in response.text.splitlines():
+        if line.startswith("process_cpu_seconds_total"):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+async def cassette_misses(client: httpx.AsyncClient, stub_port: int) -> Optional[int]:
+    """Requests the spawned stub could not answer from its cassette."""
+    try:
+        response = await client.get(f"http://localhost:{stub_port}/stats")
+        return response.json()["cassette"]["misses"]
+    except (httpx.HTTPError, ValueError, KeyError):
+        return None
+
+async def wait_for_health(client: httpx.AsyncClient, timeout: float) -> None:
+    """Wait until the server answers /health."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Server at {client.base_url} did not become healthy within {timeout:.0f}s")
+        await asyncio.sleep(0.2)
+
+def spawn_servers(args) -> list:
+    """Start the OpenWeatherMap stub and the server as child processes."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    stub_port = args.port + 1
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(here, "I14_stubOpenWeather.py"), "--port", str(stub_port),
+        "--latency-ms", str(args.upstream_latency_ms),
+    ] + (["--replay", args.replay] if args.replay else []))
+    env = dict(
+        os.environ,
+        OPENWEATHER_API_BASE=f"http://localhost:{stub_port}/data/2.5",
+        GEO_API_BASE=f"http://localhost:{stub_port}/geo/1.0",
+        OPENWEATHER_API_KEY=os.getenv("OPENWEATHER_API_KEY", "bench-key"),
+        GEOCODE_CACHE_DB="",
+        UPSTREAM_RATE_LIMIT="0",  # The stub has no quota
+        CACHE_SNAPSHOT_PATH="",  # Every run starts cold, so runs stay comparable
+        LOG_LEVEL="WARNING",
+    )
+    server = subprocess.Popen([
+        sys.executable, os.path.join(here, args.server), "--port", str(args.port), "--workers", str(args.workers),
+    ], env=env, stdout=subprocess.DEVNULL)
+    return [server, stub]
+
+def compare(result: dict, baseline: dict, max_regression: float) -> bool:
+    """Print changes against a saved run; return False if it regressed."""
+    ok = True
+    print(f"\nCompared with {baseline.get('started_at', 'baseline')}")
+    checks = [("throughput_rps", -1)] + [(f"{label} p95_ms", 1) for label in result["requests"]]
+    for name, direction in checks:
+        if name == "throughput_rps":
+            old, new = baseline.get("throughput_rps"), result["throughput_rps"]
+        else:
+            label, field = name.rsplit(" ", 1)
+            old = baseline.get("requests", {}).get(label, {}).get(field)
+            new = result["requests"][label].get(field)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        regressed = change * direction > max_regression
+        ok = ok and not regressed
+        print(f"  {name:<42}{old:>10.2f}{new:>10.2f}{change:>+9.1f}%{'  REGRESSION' if regressed else ''}")
+    return ok
+
+async def main(args) -> int:
+    processes = spawn_servers(args) if args.spawn else []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+            await wait_for_health(client, 30 if args.spawn else 5)
+            run = LoadRun(client, args.rps, args.session_calls, args.seed)
+            if args.warmup:
+                await run.run(args.concurrency, args.warmup, recording=False)
+            cpu_before = await server_cpu_seconds(client)
+            elapsed = await run.run(args.concurrency, args.duration, recording=True)
+            cpu_after = await server_cpu_seconds(client)
+            misses = await cassette_misses(client, args.port + 1) if args.spawn and args.replay else None
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    all_latencies = [ms for latencies in run.latencies.values() for ms in latencies]
+    cpu = None
+    if cpu_before is not None and cpu_after is not None:
+        cpu = {"seconds": round(cpu_after - cpu_before, 3), "percent": round((cpu_after - cpu_before) / elapsed * 100, 1)}
+    result = {
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {
+            "url": args.url, "server": args.server if args.spawn else None, "workers": args.workers,
+            "concurrency": args.concurrency, "rps": args.rps, "duration": args.duration,
+            "session_calls": args.session_calls, "seed": args.seed,
+        },
+        "requests_sent": run.sent,
+        "throughput_rps": round(run.sent / elapsed, 1),
+        "overall": summarize(all_latencies),
+        "requests": {label: summarize(latencies) for label, latencies in sorted(run.latencies.items())},
+        "errors": run.errors,
+        "error_rate": round(sum(run.errors.values()) / run.sent, 4) if run.sent else 0.0,
+        "server_cpu": cpu,
+        "cassette_misses": misses,
+    }
+
+    print(f"{run.sent} requests in {elapsed:.1f}s: {result['throughput_rps']} req/s, error rate {result['error_rate']:.2%}")
+    if cpu:
+        print(f"Server CPU: {cpu['seconds']}s ({cpu['percent']}% of one core; one worker only when --workers > 1)")
+    print(f"{'request':<36}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for label, stats in [("all", result["overall"])] + list(result["requests"].items()):
+        if stats["count"]:
+            print(f"{label:<36}{stats['count']:>8}{stats['p50_ms']:>8.2f}ms{stats['p95_ms']:>8.2f}ms{stats['p99_ms']:>8.2f}ms")
+    if run.errors:
+        print("Errors: " + ", ".join(f"{kind}={count}" for kind, count in sorted(run.errors.items())))
+    if misses:
+        # The server may have covered these from its fallback cache, so the error rate alone can hide them
+        print(f"Warning: {misses} upstream requests were not in the cassette; the replay did not match the recording")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved results to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.max_regression):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the /mcp endpoint of the weather MCP server")
+    parser.add_argument("--url", type=str, default="http://localhost:8124", help="Server base URL")
+    parser.add_argument("--concurrency", type=int, default=20, help="Simulated clients")
+    parser.add_argument("--rps", type=float, default=0, help="Target requests per second across clients (0 sends back to back)")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before the run")
+    parser.add_argument("--session-calls", type=int, default=20, help="tools/call requests per session")
+    parser.add_argument("--timeout", type=float, default=30, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the tool mix")
+    parser.add_argument("--output", type=str, help="Save results as JSON here")
+    parser.add_argument("--compare", type=str, help="Saved results to compare against")
+    parser.add_argument("--max-regression", type=float, default=10, help="Allowed p95/throughput regression in percent")
+    parser.add_argument("--spawn", action="store_true", help="Start the OpenWeatherMap stub and the server for the run")
+    parser.add_argument("--server", type=str, default="I12_newMcpStreamable.py", help="Server script for --spawn")
+    parser.add_argument("--port", type=int, default=8124, help="Server port for --spawn (the stub uses port + 1)")
+    parser.add_argument("--workers", type=int, default=1, help="Server workers for --spawn")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50, help="Stub latency for --spawn")
+    parser.add_argument("--replay", type=str, help="Cassette for the stub to replay with --spawn")
+    args = parser.parse_args()
+    if args.spawn:
+        args.url = f"http://localhost:{args.port}"
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,83 @@
+"""Build the offline city gazetteer used by the weather MCP servers.
+
+Reads a GeoNames cities dump (cities500, cities1000, cities5000 or
+cities15000 from https://download.geonames.org/export/dump/, as .txt or
+.zip) and writes a compact index the servers memory-map for geocoding:
+
+    python I18_buildGazetteer.py cities15000.zip --output gazetteer.idx
+
+The index is a header followed by fixed-width records sorted by
+normalized city name and then by descending population, so the servers
+can binary-search it without loading it. Each city is indexed under its
+name and, if different, its ASCII name. A record is 62 bytes, so
+cities15000 (~33k cities) makes a ~3 MB file and cities500 (~220k
+cities) a ~20 MB one.
+"""
+
+import argparse
+import csv
+import io
+import struct
+import sys
+import zipfile
+
+# Must match the reader in I12_newMcpStreamable.py and I13_newMcpStreamablewithdomain.py
+GAZETTEER_MAGIC = b"GZT1"
+GAZETTEER_HEADER = struct.Struct("<4sII")  # magic, record count, record size
+GAZETTEER_RECORD = struct.Struct("<48s2sffI")  # normalized name, country code, lat, lon, population
+GAZETTEER_NAME_SIZE = 48
+
+csv.field_size_limit(sys.maxsize)  # alternatenames can be very long
+
+def normalize_city(city: str) -> str:
+    """Normalize a city name the way the servers' caches do."""
+    return " ".join(city.split()).casefold()
+
+def open_dump(path: str) -> io.TextIOBase:
+    """Open a GeoNames dump, reading the .txt member out of a .zip."""
+    if path.endswith(".zip"):
+        archive = zipfile.ZipFile(path)
+        member = next(name for name in archive.namelist() if name.endswith(".txt"))
+        return io.TextIOWrapper(archive.open(member), encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+def read_cities(path: str, min_population: int) -> list:
+    """(name key, country, lat, lon, population) for each name of each city in the dump."""
+    records = []
+    skipped = 0
+    with open_dump(path) as f:
+        for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            name, ascii_name, lat, lon, country, population = row[1], row[2], row[4], row[5], row[8], row[14]
+            population = int(population or 0)
+            if population < min_population or len(country) != 2:
+                continue
+            for key in {normalize_city(name), normalize_city(ascii_name)}:
+                encoded = key.encode("utf-8")
+                if not encoded or len(encoded) > GAZETTEER_NAME_SIZE:
+                    skipped += 1
+                    continue
+                records.append((encoded, country.encode("ascii"), float(lat), float(lon), min(population, 2**32 - 1)))
+    if skipped:
+        print(f"Skipped {skipped} names longer than {GAZETTEER_NAME_SIZE} bytes")
+    return records
+
+def write_index(records: list, path: str) -> None:
+    """Write records sorted by name, most populous first, as a gazetteer index."""
+    # Null padding sorts shorter names first, matching the fixed-width byte order the reader compares
+    records.sort(key=lambda record: (record[0].ljust(GAZETTEER_NAME_SIZE, b"\0"), -record[4]))
+    with open(path, "wb") as f:
+        f.write(GAZETTEER_HEADER.pack(GAZETTEER_MAGIC, len(records), GAZETTEER_RECORD.size))
+        for record in records:
+            f.write(GAZETTEER_RECORD.pack(*record))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a memory-mapped city gazetteer from a GeoNames dump")
+    parser.add_argument("dump", type=str, help="GeoNames citiesN .txt or .zip file")
+    parser.add_argument("--output", type=str, default="gazetteer.idx", help="Index file to write")
+    parser.add_argument("--min-population", type=int, default=0, help="Leave out smaller cities")
+    args = parser.parse_args()
+
+    records = read_cities(args.dump, args.min_population)
+    write_index(records, args.output)
+    size = GAZETTEER_HEADER.size + len(records) * GAZETTEER_RECORD.size
+    print(f"🗺️  Wrote {len(records)} names to {args.output} ({size / 1e6:.1f} MB)")
@@ -0,0 +1,110 @@
+"""Benchmark typo-tolerant city lookups at gazetteer scale.
+
+Builds the server's trigram CityNameIndex over a gazetteer and times
+fuzzy lookups of exact names, names with one typo and names with two.
+Without --gazetteer a synthetic index of --names made-up city names is
+generated; pass a real one built by I18_buildGazetteer.py to measure on
+GeoNames data. Reports index build time and memory, lookup latency
+percentiles and how often the intended name came back first.
+
+    python I19_benchFuzzy.py --names 150000 --queries 2000
+    python I19_benchFuzzy.py --gazetteer gazetteer.idx
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("GEOCODE_CACHE_DB", "")
+os.environ.setdefault("GAZETTEER_PATH", "")
+
+import I12_newMcpStreamable as server
+import I18_buildGazetteer as builder
+
+SYLLABLES = ["ba", "ber", "ca", "dor", "el", "fen", "gra", "ha", "in", "jo", "ka", "lon", "ma", "nor", "o",
+             "pa", "qui", "ro", "san", "ta", "u", "ve", "wes", "xi", "ya", "zen", "ton", "burg", "ville", "stad"]
+
+def synthetic_gazetteer(count: int, path: str, rng: random.Random) -> None:
+    """Write a gazetteer of count made-up cities, some sharing names."""
+    records = []
+    for _ in range(count):
+        words = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.choice((1, 1, 1, 2)))]
+        name = " ".join(words).encode("utf-8")[:builder.GAZETTEER_NAME_SIZE]
+        country = rng.choice(["GB", "FR", "US", "IN", "JP", "DE", "BR"]).encode("ascii")
+        records.append((name, country, rng.uniform(-60, 70), rng.uniform(-180, 180), rng.randint(500, 5_000_000)))
+    builder.write_index(records, path)
+
+def add_typos(name: str, count: int, rng: random.Random) -> str:
+    """Apply count random single-character edits (swap, drop, double or replace)."""
+    letters = list(name)
+    for _ in range(count):
+        position = rng.randrange(len(letters) - 1)
+        edit = rng.choice(("swap", "drop", "double", "replace"))
+        if edit == "swap":
+            letters[position], letters[position + 1] = letters[position + 1], letters[position]
+        elif edit == "drop" and len(letters) > 3:
+            del letters[position]
+        elif edit == "double":
+            letters.insert(position, letters[position])
+        else:
+            letters[position] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return "".join(letters)
+
+def bench_queries(index: server.CityNameIndex, queries: list) -> dict:
+    """Latency percentiles in milliseconds and top-1 accuracy for (query, expected) pairs."""
+    latencies = []
+    correct = 0
+    for query, expected in queries:
+        start = time.perf_counter()
+        matches = index.search(query, server.FUZZY_MAX_SUGGESTIONS, server.FUZZY_SUGGEST_CONFIDENCE)
+        latencies.append((time.perf_counter() - start) * 1000)
+        correct += bool(matches) and matches[0]["name"] == expected
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": ordered[int(len(ordered) * 0.50)],
+        "p95_ms": ordered[int(len(ordered) * 0.95)],
+        "p99_ms": ordered[int(len(ordered) * 0.99)],
+        "mean_ms": statistics.fmean(ordered),
+        "top1": correct / len(queries),
+    }
+
+def main(args) -> None:
+    rng = random.Random(args.seed)
+    path = args.gazetteer
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "gazetteer.idx")
+        synthetic_gazetteer(args.names, path, rng)
+
+    places = server.Gazetteer(path, float("inf"))
+    places.open()
+    index = server.CityNameIndex(server.FUZZY_MAX_CANDIDATES)
+    tracemalloc.start()
+    index.build(places)
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"Gazetteer: {places.count} records, {places.stats()['mapped_bytes'] / 1e6:.1f} MB mapped")
+    print(f"Index: {len(index.names)} names, {len(index.postings)} posting lists, "
+          f"built in {index.build_seconds:.2f}s, {index_bytes / 1e6:.1f} MB")
+
+    names = [name for name in rng.sample(index.names, min(args.queries, len(index.names))) if len(name) >= 5]
+    print(f"\nLookup latency ({len(names)} queries each)")
+    print(f"{'query':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'top-1':>8}")
+    for label, typos in (("exact", 0), ("1 typo", 1), ("2 typos", 2)):
+        result = bench_queries(index, [(add_typos(name, typos, rng), name) for name in names])
+        print(
+            f"{label:<12}{result['p50_ms']:>8.2f}ms{result['p95_ms']:>8.2f}ms"
+            f"{result['p99_ms']:>8.2f}ms{result['top1']:>8.1%}"
+        )
+    places.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fuzzy city-name lookups in the weather MCP server")
+    parser.add_argument("--gazetteer", type=str, help="Index built by I18_buildGazetteer.py (default: synthetic)")
+    parser.add_argument("--names", type=int, default=150000, help="Cities in the synthetic gazetteer")
+    parser.add_argument("--queries", type=int, default=2000, help="Lookups per query type")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for names and typos")
+    main(parser.parse_args())
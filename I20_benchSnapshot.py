@@ -0,0 +1,95 @@
+"""Benchmark saving and restoring the cache snapshot.
+
+Fills the server's geocode and weather caches with --entries entries
+each, using responses shaped like the stub upstream's, then times
+CacheSnapshot.save() (copy, encode, compress, write) and restore()
+(read, decompress, decode, load) over --rounds runs. Reports the
+median and worst times, the snapshot size and the longest the event
+loop went without running while a save was in progress.
+
+    python I20_benchSnapshot.py --entries 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("GEOCODE_CACHE_DB", "")
+os.environ.setdefault("GAZETTEER_PATH", "")
+
+import I12_newMcpStreamable as server
+import I14_stubOpenWeather as stub
+
+def fill_caches(count: int, rng: random.Random) -> None:
+    """Put count geocode entries and count weather entries in the server's caches."""
+    server.geocode_cache.maxsize = count
+    server.weather_cache.maxsize = count
+    expires_at = time.time() + server.geocode_cache.ttl
+    now = time.monotonic()
+    for i in range(count):
+        lat, lon = round(rng.uniform(-60, 70), 4), round(rng.uniform(-180, 180), 4)
+        server.geocode_cache.remember(f"city {i}", lat, lon, expires_at)
+        key = ("weather", lat, lon, "metric")
+        server.weather_cache.remember(key, stub.current(lat, lon, "metric"), now - rng.uniform(0, 300))
+
+def clear_caches() -> None:
+    """Empty both caches so restore() loads every entry."""
+    server.geocode_cache.entries.clear()
+    server.weather_cache.entries.clear()
+    server.weather_cache.cells.clear()
+
+async def timed_save(snapshot) -> float:
+    """Save a snapshot; return the longest gap between event loop ticks meanwhile."""
+    longest = 0.0
+
+    async def ticker():
+        nonlocal longest
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    ticks = asyncio.create_task(ticker())
+    await snapshot.save()
+    ticks.cancel()
+    return longest
+
+def summary(seconds: list) -> str:
+    return f"median {statistics.median(seconds) * 1000:8.1f}ms   max {max(seconds) * 1000:8.1f}ms"
+
+def main(args) -> None:
+    rng = random.Random(args.seed)
+    fill_caches(args.entries, rng)
+    snapshot = server.CacheSnapshot(os.path.join(tempfile.mkdtemp(), "cache_snapshot.bin"), 0)
+    print(f"Caches: {len(server.geocode_cache.entries)} geocode, {len(server.weather_cache.entries)} weather entries")
+
+    save_times, restore_times, stalls = [], [], []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        stalls.append(asyncio.run(timed_save(snapshot)))
+        save_times.append(time.perf_counter() - start)
+        clear_caches()
+        start = time.perf_counter()
+        snapshot.restore()
+        restore_times.append(time.perf_counter() - start)
+
+    size = os.path.getsize(snapshot.path)
+    entries = len(server.geocode_cache.entries) + len(server.weather_cache.entries)
+    print(f"Snapshot: {size / 1e6:.1f} MB, {size / entries:.0f} bytes per entry")
+    print(f"save     {summary(save_times)}   (event loop stalled {max(stalls) * 1000:.1f}ms at most)")
+    print(f"restore  {summary(restore_times)}   ({snapshot.restored['geocode']} geocode, "
+          f"{snapshot.restored['weather']} weather restored)")
+    os.remove(snapshot.path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the weather MCP server's cache snapshot")
+    parser.add_argument("--entries", type=int, default=100000, help="Entries in each cache")
+    parser.add_argument("--rounds", type=int, default=5, help="Save/restore cycles to time")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for locations and ages")
+    main(parser.parse_args())
@@ -59,6 +59,7 @@ if $DOCKER_COMPOSE ps | grep -q "Up"; then
     echo "  - get_weather(city)"
     echo "  - get_forecast(city, days)"
     echo "  - get_weather_alerts(city)"
+    echo "  - compare_weather(cities)"
     echo "  - compare_cities_weather(city1, city2)"
     echo "  - get_current_time()"
     echo "  - echo_message(message)"